@@ -0,0 +1,216 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import Config
+from app.metrics import USER_CACHE_ERRORS, USER_CACHE_LOOKUPS
+from app.tasks.queue import get_redis
+
+logger = logging.getLogger("whatsapp_cache")
+
+USER_KEY = "user_state:{}"
+
+# Cached "no such user" (briefly) so START chatter bursts skip SQLite too.
+# Redis only: a per-process LRU would keep saying "missing" after another
+# gunicorn worker created the user, and the name reply would be ignored.
+_MISSING = "null"
+
+
+# -------------------------------------------------
+# In-process LRU with TTL
+# -------------------------------------------------
+class LRUCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (hit, value)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return False, None
+
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def add(self, key, value):
+        """set() unless a live entry exists; False if one did."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                return False
+
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local_cache = LRUCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
+
+_HITS = USER_CACHE_LOOKUPS.labels(result="hit")
+_MISSES = USER_CACHE_LOOKUPS.labels(result="miss")
+
+
+def _encode(user):
+    return _MISSING if user is None else json.dumps(list(user))
+
+
+def _decode(raw):
+    return None if raw == _MISSING else tuple(json.loads(raw))
+
+
+# -------------------------------------------------
+# User state cache (phone → (name, state, redeemed_at) | None)
+# -------------------------------------------------
+def get_cached_user(phone: str):
+    """Return (hit, user); any backend failure counts as a miss."""
+    backend = Config.USER_CACHE_BACKEND
+    hit, user = False, None
+
+    if backend == "memory":
+        hit, user = _local_cache.get(phone)
+    elif backend == "redis":
+        try:
+            raw = get_redis().get(USER_KEY.format(phone))
+        except Exception:
+            USER_CACHE_ERRORS.inc()
+            logger.exception("🔥 User cache read failed")
+            raw = None
+        if raw is not None:
+            hit, user = True, _decode(raw)
+
+    if backend != "off":
+        (_HITS if hit else _MISSES).inc()
+    return hit, user
+
+
+def get_cached_users(phones):
+    """Return ({phone: user} for hits, [missed phones]) in one round trip."""
+    backend = Config.USER_CACHE_BACKEND
+    phones = list(phones)
+    found = {}
+
+    if backend == "memory":
+        for phone in phones:
+            hit, user = _local_cache.get(phone)
+            if hit:
+                found[phone] = user
+    elif backend == "redis" and phones:
+        try:
+            raws = get_redis().mget([USER_KEY.format(p) for p in phones])
+        except Exception:
+            USER_CACHE_ERRORS.inc()
+            logger.exception("🔥 User cache read failed")
+            raws = [None] * len(phones)
+        for phone, raw in zip(phones, raws):
+            if raw is not None:
+                found[phone] = _decode(raw)
+
+    if backend != "off":
+        _HITS.inc(len(found))
+        _MISSES.inc(len(phones) - len(found))
+    return found, [p for p in phones if p not in found]
+
+
+def set_cached_user(phone: str, user):
+    backend = Config.USER_CACHE_BACKEND
+
+    if backend == "memory":
+        if user is None:
+            _local_cache.delete(phone)
+        else:
+            _local_cache.set(phone, user)
+    elif backend == "redis":
+        try:
+            get_redis().set(
+                USER_KEY.format(phone), _encode(user), ex=Config.USER_CACHE_TTL
+            )
+        except Exception:
+            USER_CACHE_ERRORS.inc()
+            logger.exception("🔥 User cache write failed")
+
+
+# Read-through fills race with writes: a fill that read the row before an
+# upsert committed must never overwrite the upsert's write-through. Fills
+# therefore only add missing keys (SET NX), and a cached "missing" lives
+# USER_CACHE_MISS_TTL, not USER_CACHE_TTL, in case it lost that race to an
+# invalidation instead.
+def _fill_ttl(user):
+    return Config.USER_CACHE_MISS_TTL if user is None else Config.USER_CACHE_TTL
+
+
+def fill_cached_user(phone: str, user):
+    fill_cached_users({phone: user})
+
+
+def fill_cached_users(users: dict):
+    backend = Config.USER_CACHE_BACKEND
+
+    if backend == "memory":
+        for phone, user in users.items():
+            if user is not None:
+                _local_cache.add(phone, user)
+    elif backend == "redis" and users:
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for phone, user in users.items():
+                pipe.set(USER_KEY.format(phone), _encode(user), ex=_fill_ttl(user), nx=True)
+            pipe.execute()
+        except Exception:
+            USER_CACHE_ERRORS.inc()
+            logger.exception("🔥 User cache write failed")
+
+
+def invalidate_user(phone: str):
+    backend = Config.USER_CACHE_BACKEND
+
+    if backend == "memory":
+        _local_cache.delete(phone)
+    elif backend == "redis":
+        try:
+            get_redis().delete(USER_KEY.format(phone))
+        except Exception:
+            USER_CACHE_ERRORS.inc()
+            logger.exception("🔥 User cache invalidation failed")
+
+
+def invalidate_users(phones):
+    backend = Config.USER_CACHE_BACKEND
+    phones = list(phones)
+
+    if backend == "memory":
+        for phone in phones:
+            _local_cache.delete(phone)
+    elif backend == "redis" and phones:
+        try:
+            get_redis().delete(*[USER_KEY.format(p) for p in phones])
+        except Exception:
+            USER_CACHE_ERRORS.inc()
+            logger.exception("🔥 User cache invalidation failed")
+
@@ -4,8 +4,48 @@ class Config:
     VERIFY_TOKEN = os.getenv("VERIFY_TOKEN", "dev_token")
     WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN", "")
     PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID","")
-    WHATSAPP_API_URL = f"https://partnersv1.pinbot.ai/v3/{PHONE_NUMBER_ID}/messages"
+    WHATSAPP_API_URL = os.getenv(
+        "WHATSAPP_API_URL", f"https://partnersv1.pinbot.ai/v3/{PHONE_NUMBER_ID}/messages"
+    )
+    WHATSAPP_MEDIA_URL = os.getenv(
+        "WHATSAPP_MEDIA_URL", f"https://partnersv1.pinbot.ai/v3/{PHONE_NUMBER_ID}/media"
+    )
     PORT = int(os.getenv("PORT", 8000))
     REDIS_HOST = os.getenv("REDIS_HOST", "redis")
     REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
     BASE_URL = "https://allspray.in"
+    RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", 2))
+    QUOTA_BACKEND = os.getenv("QUOTA_BACKEND", "sqlite")  # sqlite | redis
+    QUOTA_WRITEBACK_SECONDS = int(os.getenv("QUOTA_WRITEBACK_SECONDS", 5))
+    COUPON_OUTBOX_SECONDS = int(os.getenv("COUPON_OUTBOX_SECONDS", 30))  # relay renders not enqueued by then
+    USER_CACHE_BACKEND = os.getenv("USER_CACHE_BACKEND", "redis")  # redis | memory (single process) | off
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 300))
+    USER_CACHE_MISS_TTL = int(os.getenv("USER_CACHE_MISS_TTL", 5))  # cached "no such user"
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 8))
+    WHATSAPP_RATE_LIMIT = float(os.getenv("WHATSAPP_RATE_LIMIT", 20))  # msgs/sec, 0 = off
+    WHATSAPP_RATE_BURST = int(os.getenv("WHATSAPP_RATE_BURST", 20))
+    WHATSAPP_MAX_RETRIES = int(os.getenv("WHATSAPP_MAX_RETRIES", 5))
+    WHATSAPP_BACKOFF_BASE = float(os.getenv("WHATSAPP_BACKOFF_BASE", 0.5))
+    WHATSAPP_BACKOFF_MAX = float(os.getenv("WHATSAPP_BACKOFF_MAX", 30))
+    WORKER_MAX_ATTEMPTS = int(os.getenv("WORKER_MAX_ATTEMPTS", 5))
+    WORKER_HEARTBEAT_TTL = int(os.getenv("WORKER_HEARTBEAT_TTL", 30))
+    WORKER_REAP_INTERVAL = int(os.getenv("WORKER_REAP_INTERVAL", 30))
+    DEDUP_TTL = int(os.getenv("DEDUP_TTL", 86400))
+    WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "inline")  # inline | queue
+    INGRESS_PARTITIONS = int(os.getenv("INGRESS_PARTITIONS", 4))
+    INGRESS_MAXLEN = int(os.getenv("INGRESS_MAXLEN", 100000))
+    INGRESS_MAX_ATTEMPTS = int(os.getenv("INGRESS_MAX_ATTEMPTS", 5))
+    DB_PATH = os.getenv("DB_PATH", "quota.db")
+    COUPON_FORMAT = os.getenv("COUPON_FORMAT", "jpeg")  # jpeg | png
+    COUPON_QUALITY = int(os.getenv("COUPON_QUALITY", 88))
+    COUPON_PNG_COMPRESS_LEVEL = int(os.getenv("COUPON_PNG_COMPRESS_LEVEL", 3))
+    COUPON_DELIVERY = os.getenv("COUPON_DELIVERY", "link")  # link | upload
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))  # worker exporters, 0 = off
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # X-Admin-Token for /admin/export; unset = disabled
+    QR_SIGNING_KEY = os.getenv("QR_SIGNING_KEY", "")  # required unless QR_DEV_KEY
+    QR_DEV_KEY = os.getenv("QR_DEV_KEY", "0") == "1"  # local only: forgeable fixed key
+    QR_CAMPAIGN = os.getenv("QR_CAMPAIGN", "MELUR").upper()  # A-Z/0-9 only
+    QR_TOKEN_MAX_AGE_DAYS = int(os.getenv("QR_TOKEN_MAX_AGE_DAYS", 0))  # 0 = no expiry
+    QR_ALLOW_UNSIGNED = os.getenv("QR_ALLOW_UNSIGNED", "0") == "1"  # legacy bare-phone QRs (forgeable)
+    QR_BATCH_MAX = int(os.getenv("QR_BATCH_MAX", 500))  # scans per sync request
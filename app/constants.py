@@ -9,3 +9,6 @@ PRODUCT = {
     "preview_image": "https://allspray.in/static/images/product1.png",
     "code_image": "https://allspray.in/static/images/coupon.png",
 }
+
+# Sent with every coupon image (webhook and the coupon outbox relay)
+COUPON_CAPTION = "🎟️ இந்த கூப்பனை கடையில் காட்டவும்"
@@ -0,0 +1,316 @@
+import hashlib
+import io
+import logging
+import os
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+import qrcode
+
+from app.config import Config
+from app.metrics import COUPON_ENCODE_SECONDS, COUPON_RENDER_SECONDS
+from app.qr_token import issue_epoch, sign_qr, signing_key_id
+
+logger = logging.getLogger("whatsapp_coupon")
+
+# -------------------------------------------------
+# Project paths
+# -------------------------------------------------
+BASE_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..")
+)
+
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+IMAGE_DIR = os.path.join(STATIC_DIR, "images")
+GENERATED_DIR = os.path.join(IMAGE_DIR, "generated")
+
+BASE_COUPON_PATH = os.path.join(IMAGE_DIR, "base_coupon.png")
+FONT_PATH = os.path.join(STATIC_DIR, "fonts", "DejaVuSans-Bold.ttf")
+
+logger.info(f"📁 BASE_DIR={BASE_DIR}")
+logger.info(f"🖼️ BASE_COUPON_PATH={BASE_COUPON_PATH}")
+logger.info(f"🔤 FONT_PATH={FONT_PATH}")
+
+# -----------------------------
+# Text config (LOCKED)
+# -----------------------------
+FONT_SIZE = 30
+Y_NAME = 1000
+Y_PHONE = 1050
+LEFT_PERCENT = 0.25
+
+# -----------------------------
+# QR config (LOCKED)
+# -----------------------------
+QR_SIZE = 260
+TEXT_TO_QR_GAP = 110
+
+# Bump when the drawing code changes so old content keys stop matching
+RENDER_VERSION = "3"
+
+# -------------------------------------------------
+# Template cache (per process, mtime invalidated)
+# -------------------------------------------------
+_template_cache = {}
+
+
+def _load_cached(key, path, loader):
+    """Return loader(path), re-running it only when the file's mtime changes."""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _template_cache.get(key)
+
+    if cached is None or cached[0] != mtime:
+        logger.info(f"📦 Loading template asset → {path}")
+        cached = (mtime, loader(path))
+        _template_cache[key] = cached
+
+    return cached[1]
+
+
+def _decode_base(path):
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+        img.load()
+    return img
+
+
+def get_template():
+    """The shared, pre-decoded RGB base coupon. Never draw on it directly."""
+    return _load_cached("base", BASE_COUPON_PATH, _decode_base)
+
+
+def get_font(size: int):
+    return _load_cached(
+        ("font", size),
+        FONT_PATH,
+        lambda path: ImageFont.truetype(path, size),
+    )
+
+
+# -------------------------------------------------
+# Per-user patches (only these regions differ between coupons)
+# -------------------------------------------------
+def render_text_patch(template, name: str, safe_phone: str):
+    """Draw name + phone on a crop of the template's text band."""
+    font = get_font(FONT_SIZE)
+    ascent, descent = font.getmetrics()
+
+    x_text = int(template.width * LEFT_PERCENT)
+    box = (x_text, Y_NAME, template.width, Y_PHONE + ascent + descent)
+
+    patch = template.crop(box)
+    draw = ImageDraw.Draw(patch)
+    draw.text((0, 0), name, fill="white", font=font)
+    draw.text((0, Y_PHONE - Y_NAME), f"Mobile: {safe_phone}", fill="white", font=font)
+
+    return patch, box[:2]
+
+
+# Error correction matches the original rendering; border is in modules
+QR_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_Q
+QR_BORDER = 2
+
+# (payload length, encoding mode) → smallest QR version that fits
+_qr_versions = {}
+
+
+def _qr_version(qr_data: str) -> int:
+    """Best-fit the QR version once per payload shape instead of per coupon."""
+    key = (len(qr_data), qrcode.util.optimal_mode(qr_data.encode()))
+    version = _qr_versions.get(key)
+
+    if version is None:
+        qr = qrcode.QRCode(version=None, error_correction=QR_ERROR_CORRECTION)
+        qr.add_data(qr_data, optimize=0)
+        qr.make(fit=True)
+        version = _qr_versions[key] = qr.version
+
+    return version
+
+
+def _qr_modules(qr_data: str):
+    qr = qrcode.QRCode(
+        version=_qr_version(qr_data),
+        error_correction=QR_ERROR_CORRECTION,
+        border=QR_BORDER,
+    )
+    # Single segment: same length + mode always needs the same bits
+    qr.add_data(qr_data, optimize=0)
+    try:
+        qr.make(fit=False)
+    except qrcode.exceptions.DataOverflowError:
+        qr.make(fit=True)
+    return qr.modules
+
+
+@lru_cache(maxsize=256)
+def render_qr_patch(qr_data: str):
+    """
+    1-bit mask of the dark modules, scaled by an integer factor with
+    nearest-neighbour so every module stays a crisp square.
+
+    Returns (mask, offset) where offset centres the mask in the
+    QR_SIZE square. Cached, so re-rendering a coupon skips the encode.
+    """
+    modules = _qr_modules(qr_data)
+    count = len(modules)
+    size = count + 2 * QR_BORDER
+
+    # One byte per pixel (0xFF = dark), quiet zone left blank
+    bitmap = bytearray(size * size)
+    for y, row in enumerate(modules):
+        start = (y + QR_BORDER) * size + QR_BORDER
+        bitmap[start:start + count] = bytes(0xFF if dark else 0 for dark in row)
+
+    box = max(1, QR_SIZE // size)
+    mask = Image.frombytes("1", (size, size), bytes(bitmap), "raw", "1;8")
+    mask = mask.resize((size * box, size * box), Image.NEAREST)
+
+    return mask, (QR_SIZE - size * box) // 2
+
+
+@COUPON_RENDER_SECONDS.time()
+def render_coupon(name: str, phone: str):
+    """Compose the personalised coupon image from the cached template."""
+    template = get_template()
+
+    name = name.strip()[:25]
+    safe_phone = "".join(c for c in phone if c.isdigit())
+
+    text_patch, text_pos = render_text_patch(template, name, safe_phone)
+    qr_mask, qr_offset = render_qr_patch(sign_qr(safe_phone))
+
+    # -----------------------------
+    # Center-align QR
+    # -----------------------------
+    qr_x = (template.width - QR_SIZE) // 2
+    qr_y = Y_PHONE + TEXT_TO_QR_GAP
+
+    img = template.copy()
+    img.paste(text_patch, text_pos)
+    img.paste("white", (qr_x, qr_y, qr_x + QR_SIZE, qr_y + QR_SIZE))
+    img.paste("black", (qr_x + qr_offset, qr_y + qr_offset), qr_mask)
+    return img
+
+
+# -------------------------------------------------
+# Encoding
+# -------------------------------------------------
+# WhatsApp image messages only accept JPEG and PNG.
+ENCODERS = {
+    "jpeg": ("jpg", "image/jpeg", lambda: {
+        "format": "JPEG",
+        "quality": Config.COUPON_QUALITY,
+        "optimize": True,
+        # No chroma subsampling keeps QR edges and text crisp
+        "subsampling": 0,
+    }),
+    "png": ("png", "image/png", lambda: {
+        "format": "PNG",
+        "compress_level": Config.COUPON_PNG_COMPRESS_LEVEL,
+    }),
+}
+
+
+def encode_coupon(img):
+    """Encode with the configured COUPON_FORMAT; returns (bytes, extension)."""
+    ext, _, options = ENCODERS[Config.COUPON_FORMAT]
+    buf = io.BytesIO()
+    with COUPON_ENCODE_SECONDS.labels(format=Config.COUPON_FORMAT).time():
+        img.save(buf, **options())
+    return buf.getvalue(), ext
+
+
+def render_coupon_bytes(name: str, phone: str):
+    """Render + encode without touching disk; returns (bytes, filename, mime)."""
+    name, safe_phone = normalize(name, phone)
+    data, ext = encode_coupon(render_coupon(name, safe_phone))
+    _, mime, _ = ENCODERS[Config.COUPON_FORMAT]
+    return data, f"coupon_{safe_phone}.{ext}", mime
+
+
+# -------------------------------------------------
+# Content-addressed storage
+# -------------------------------------------------
+def normalize(name: str, phone: str):
+    return name.strip()[:25], "".join(c for c in phone if c.isdigit())
+
+
+def _file_digest(path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def render_fingerprint() -> str:
+    """Everything besides name/phone that changes the rendered bytes."""
+    parts = (
+        RENDER_VERSION,
+        # File contents, not mtimes: a redeploy or copy that only touches
+        # the assets keeps every generated coupon valid
+        _load_cached("base_digest", BASE_COUPON_PATH, _file_digest),
+        _load_cached("font_digest", FONT_PATH, _file_digest),
+        Config.COUPON_FORMAT,
+        str(Config.COUPON_QUALITY),
+        str(Config.COUPON_PNG_COMPRESS_LEVEL),
+        # The QR token; its issue time is not part of the key, so a reused
+        # file keeps the token it was first signed with
+        Config.QR_CAMPAIGN,
+        signing_key_id(),
+    )
+    # When tokens expire, the key moves to a new file every issue_epoch(),
+    # so a reused file never carries a token that is about to be rejected
+    epoch = issue_epoch()
+    return "|".join((*parts, epoch) if epoch else parts)
+
+
+def coupon_key(name: str, safe_phone: str, fingerprint: str | None = None) -> str:
+    digest = hashlib.sha256()
+    for part in (name, safe_phone, fingerprint or render_fingerprint()):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def coupon_relpath(key: str) -> str:
+    """Two-level sharding keeps every directory small: ab/cd/abcd....jpg"""
+    ext, _, _ = ENCODERS[Config.COUPON_FORMAT]
+    return os.path.join(key[:2], key[2:4], f"{key}.{ext}")
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    # nginx never sees a half-written file, racing renderers just overwrite
+    os.replace(tmp, path)
+
+
+# -------------------------------------------------
+# Image generation
+# -------------------------------------------------
+
+def generate_coupon(name: str, phone: str) -> str:
+    logger.info(f"🧩 Generating coupon for {phone} | name='{name}'")
+
+    name, safe_phone = normalize(name, phone)
+    relpath = coupon_relpath(coupon_key(name, safe_phone))
+    output_path = os.path.join(GENERATED_DIR, relpath)
+
+    # -----------------------------
+    # Save (content hash → identical renders share one file)
+    # -----------------------------
+    if os.path.exists(output_path):
+        # Fresh mtime keeps the GC grace period from racing this send
+        os.utime(output_path)
+        logger.info(f"♻️ Reusing existing coupon → {output_path}")
+    else:
+        img = render_coupon(name, safe_phone)
+        data, _ = encode_coupon(img)
+        _write_atomic(output_path, data)
+        logger.info(f"✅ Coupon generated → {output_path} ({len(data)} bytes)")
+
+    image_url = f"{Config.BASE_URL}/static/images/generated/{relpath.replace(os.sep, '/')}"
+
+    logger.info(f"🌍 Public image URL → {image_url}")
+
+    return image_url
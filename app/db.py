@@ -1,16 +1,168 @@
+import atexit
+import logging
+import os
 import sqlite3
+import threading
+import time
 from pathlib import Path
 from contextlib import contextmanager
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+
+from app.cache import (
+    get_cached_user,
+    get_cached_users,
+    set_cached_user,
+    fill_cached_user,
+    fill_cached_users,
+    invalidate_user,
+    invalidate_users,
+)
+from app.config import Config
+from app.metrics import db_timed
+from app.tasks.queue import get_redis
+
+DB_PATH = Path(Config.DB_PATH)
+
+logger = logging.getLogger("whatsapp_db")
+
+# Applied once per connection; journal_mode=WAL is persisted in the file.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+_local = threading.local()
+
+# Redis quota backend: one hash mirrored from the SQLite quota row.
+QUOTA_KEY = "quota"
+QUOTA_WRITEBACK_LOCK = "quota:writeback"
+
+# Returns 1 when a slot was reserved, 0 when exhausted, -1 when unseeded.
+RESERVE_QUOTA_LUA = """
+local quota = redis.call('HMGET', KEYS[1], 'max_images', 'sent_images')
+if not quota[1] or not quota[2] then
+    return -1
+end
+if tonumber(quota[2]) >= tonumber(quota[1]) then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'sent_images', 1)
+return 1
+"""
+
+# -------------------------------------------------
+# Campaign stats (maintained by triggers)
+# -------------------------------------------------
+# Triggers run inside whichever transaction changes users/sent_users
+# (upsert_user, redeem_user(s), complete_signup), so the aggregates can
+# never drift from the rows and no writer has to remember to update them.
+HOUR_BUCKET = "'%Y-%m-%dT%H:00:00Z'"
+
+STATS_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS user_state_counts (
+        state TEXT PRIMARY KEY,
+        users INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS hourly_stats (
+        hour TEXT NOT NULL,
+        event TEXT NOT NULL,  -- issued | redeemed
+        count INTEGER NOT NULL,
+        PRIMARY KEY (hour, event)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users
+    BEGIN
+        INSERT INTO user_state_counts (state, users) VALUES (NEW.state, 1)
+        ON CONFLICT(state) DO UPDATE SET users = users + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_stats_update AFTER UPDATE OF state ON users
+    WHEN OLD.state IS NOT NEW.state
+    BEGIN
+        UPDATE user_state_counts SET users = users - 1 WHERE state = OLD.state;
+        INSERT INTO user_state_counts (state, users) VALUES (NEW.state, 1)
+        ON CONFLICT(state) DO UPDATE SET users = users + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_stats_delete AFTER DELETE ON users
+    BEGIN
+        UPDATE user_state_counts SET users = users - 1 WHERE state = OLD.state;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS users_stats_redeemed AFTER UPDATE OF state ON users
+    WHEN NEW.state = 'REDEEMED' AND OLD.state IS NOT 'REDEEMED'
+    BEGIN
+        INSERT INTO hourly_stats (hour, event, count)
+        VALUES (
+            COALESCE(
+                strftime({HOUR_BUCKET}, NEW.redeemed_at),
+                strftime({HOUR_BUCKET}, 'now')
+            ),
+            'redeemed',
+            1
+        )
+        ON CONFLICT(hour, event) DO UPDATE SET count = count + 1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS sent_users_stats_issued AFTER INSERT ON sent_users
+    BEGIN
+        INSERT INTO hourly_stats (hour, event, count)
+        VALUES (strftime({HOUR_BUCKET}, 'now'), 'issued', 1)
+        ON CONFLICT(hour, event) DO UPDATE SET count = count + 1;
+    END
+    """,
+)
+
+
+def _init_stats(conn):
+    """Create stats tables/triggers; backfill once from existing rows."""
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+
+    cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_state_counts'"
+    )
+    backfill = cur.fetchone() is None
+
+    for statement in STATS_SCHEMA:
+        cur.execute(statement)
+
+    if backfill:
+        # One-off scan on upgrade; issue times were never stored, so only
+        # redemptions get historical hourly buckets.
+        cur.execute(
+            """
+            INSERT INTO user_state_counts (state, users)
+            SELECT state, COUNT(*) FROM users GROUP BY state
+            """
+        )
+        cur.execute(
+            f"""
+            INSERT INTO hourly_stats (hour, event, count)
+            SELECT strftime({HOUR_BUCKET}, redeemed_at), 'redeemed', COUNT(*)
+            FROM users
+            WHERE state = 'REDEEMED' AND strftime({HOUR_BUCKET}, redeemed_at) IS NOT NULL
+            GROUP BY 1
+            """
+        )
 
-DB_PATH = Path("quota.db")
+    conn.commit()
 
 
-# Use WAL mode for better concurrency
 def init_db():
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("PRAGMA journal_mode=WAL;")
 
         # Global quota
         cur.execute(
@@ -44,6 +196,27 @@ def init_db():
         """
         )
 
+        # Webhook dedup fallback when Redis is unavailable
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processed_messages (
+                id TEXT PRIMARY KEY,
+                seen_at TEXT NOT NULL
+            )
+        """
+        )
+
+        # Granted coupons whose render task may not have reached Redis yet
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS coupon_outbox (
+                phone TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                granted_at TEXT NOT NULL
+            )
+        """
+        )
+
         # Initialize quota row if missing
         cur.execute("SELECT COUNT(*) FROM quota")
         if cur.fetchone()[0] == 0:
@@ -52,81 +225,233 @@ def init_db():
             )
         conn.commit()
 
+        _init_stats(conn)
 
-@contextmanager
-def get_conn():
-    """Provide a thread-safe connection using WAL mode."""
+
+def _connect():
     conn = sqlite3.connect(
         DB_PATH, timeout=30, isolation_level=None
     )  # autocommit off for transactions
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+@contextmanager
+def get_conn():
+    """Provide this thread's reused WAL connection (reopened after fork)."""
+    conn = getattr(_local, "conn", None)
+
+    if conn is None or _local.pid != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+
     try:
         yield conn
-    finally:
-        conn.close()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
 
 
-def get_quota():
+def iter_pages(table: str, columns, states=None, page_size: int = 1000, after: str = ""):
+    """
+    Yield lists of `columns` rows of `table` ordered by columns[0] (a unique
+    key), starting after `after`. `states` filters users by state.
+
+    Each page is fetched whole and its read ends before it is yielded, so
+    a slow consumer never holds a read transaction open: WAL checkpoints
+    keep running and memory stays at one page. Table and column names are
+    interpolated, so callers pass fixed identifiers only.
+    """
+    key = columns[0]
+
+    where, params = f"{key} > ?", []
+    if states and table == "users":
+        where += f" AND state IN ({','.join('?' * len(states))})"
+        params = list(states)
+
+    sql = (
+        f"SELECT {', '.join(columns)} FROM {table} "
+        f"WHERE {where} ORDER BY {key} LIMIT ?"
+    )
+
+    while True:
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, [after, *params, page_size])
+            page = cur.fetchall()
+
+        if not page:
+            return
+
+        yield page
+        after = page[-1][0]
+
+
+def _redis_quota_enabled():
+    return Config.QUOTA_BACKEND == "redis"
+
+
+def _db_quota():
     with get_conn() as conn:
         cur = conn.cursor()
         cur.execute("SELECT max_images, sent_images FROM quota WHERE id = 1")
         return cur.fetchone()  # (max_images, sent_images)
 
 
-def increment_sent():
+def _seed_redis_quota(r):
+    """Load the durable SQLite counters into Redis unless already present."""
+    max_images, sent_images = _db_quota()
+    r.hsetnx(QUOTA_KEY, "max_images", max_images)
+    r.hsetnx(QUOTA_KEY, "sent_images", sent_images)
+
+
+def _redis_quota(r):
+    max_images, sent_images = r.hmget(QUOTA_KEY, "max_images", "sent_images")
+    if max_images is None or sent_images is None:
+        _seed_redis_quota(r)
+        max_images, sent_images = r.hmget(QUOTA_KEY, "max_images", "sent_images")
+    return int(max_images), int(sent_images)
+
+
+@db_timed
+def reserve_quota() -> bool:
+    """Atomically take one slot from the Redis quota."""
+    r = get_redis()
+    reserved = r.eval(RESERVE_QUOTA_LUA, 1, QUOTA_KEY)
+    if reserved == -1:
+        _seed_redis_quota(r)
+        reserved = r.eval(RESERVE_QUOTA_LUA, 1, QUOTA_KEY)
+    return reserved == 1
+
+
+@db_timed
+def release_quota():
+    get_redis().hincrby(QUOTA_KEY, "sent_images", -1)
+
+
+@db_timed
+def write_back_quota(force: bool = False):
+    """Persist the Redis counters to SQLite, at most once per interval."""
+    r = get_redis()
+    if not force and not r.set(
+        QUOTA_WRITEBACK_LOCK, 1, nx=True, ex=Config.QUOTA_WRITEBACK_SECONDS
+    ):
+        return
+
+    max_images, sent_images = _redis_quota(r)
     with get_conn() as conn:
         cur = conn.cursor()
-        # Lock the row for this transaction to prevent race
-        cur.execute("BEGIN IMMEDIATE")
-        cur.execute("SELECT sent_images, max_images FROM quota WHERE id = 1")
-        sent_images, max_images = cur.fetchone()
-        if sent_images < max_images:
-            cur.execute("UPDATE quota SET sent_images = sent_images + 1 WHERE id = 1")
-            conn.commit()
-            return True
-        else:
-            conn.rollback()
-            return False
+        cur.execute(
+            "UPDATE quota SET max_images = ?, sent_images = ? WHERE id = 1",
+            (max_images, sent_images),
+        )
+        conn.commit()
+
+
+def flush_quota():
+    """Force a write-back now (shutdown); never raises."""
+    if not _redis_quota_enabled():
+        return
+    try:
+        write_back_quota(force=True)
+    except Exception:
+        logger.exception("🔥 Quota write-back failed")
 
 
+_writeback_pid = None
+
+
+def start_quota_writeback():
+    """
+    Write the Redis quota back to SQLite on a timer, and once more at exit.
+
+    Grant-driven write-backs alone would leave the last window before a
+    quiet period only in Redis (which has no volume); a recreated Redis
+    would then reseed from stale counters and oversell.
+    """
+    global _writeback_pid
+    if not _redis_quota_enabled() or _writeback_pid == os.getpid():
+        return
+    _writeback_pid = os.getpid()
+
+    def loop():
+        while True:
+            time.sleep(Config.QUOTA_WRITEBACK_SECONDS)
+            try:
+                # Shares the grant path's lock: one write per interval overall
+                write_back_quota()
+            except Exception:
+                logger.exception("🔥 Quota write-back failed")
+
+    threading.Thread(target=loop, name="quota-writeback", daemon=True).start()
+    atexit.register(flush_quota)
+
+
+@db_timed
+def get_quota():
+    if _redis_quota_enabled():
+        return _redis_quota(get_redis())
+    return _db_quota()
+
+
+@db_timed
 def update_max_quota(value: int):
     with get_conn() as conn:
         cur = conn.cursor()
         cur.execute("UPDATE quota SET max_images = ? WHERE id = 1", (value,))
         conn.commit()
 
+    if _redis_quota_enabled():
+        r = get_redis()
+        _seed_redis_quota(r)
+        r.hset(QUOTA_KEY, "max_images", value)
 
-def has_user_received(phone: str) -> bool:
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT 1 FROM sent_users WHERE phone = ?", (phone,))
-        return cur.fetchone() is not None
 
+@db_timed
+def get_user(phone: str):
+    hit, user = get_cached_user(phone)
+    if hit:
+        return user
 
-def mark_user_received(phone: str):
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("INSERT OR IGNORE INTO sent_users (phone) VALUES (?)", (phone,))
-        conn.commit()
+        cur.execute(
+            "SELECT name, state, redeemed_at FROM users WHERE phone = ?",
+            (phone,)
+        )
+        user = cur.fetchone()  # (name, state, redeemed_at)
 
+    fill_cached_user(phone, user)
+    return user
 
-def can_send_image() -> bool:
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT max_images, sent_images FROM quota WHERE id = 1")
-        max_images, sent_images = cur.fetchone()
-        return sent_images < max_images
 
+@db_timed
+def get_users(phones) -> dict:
+    """Batch get_user: {phone: (name, state, redeemed_at) | None}."""
+    users, missing = get_cached_users(phones)
+    if not missing:
+        return users
 
-def get_user(phone: str):
+    loaded = dict.fromkeys(missing)
     with get_conn() as conn:
         cur = conn.cursor()
+        placeholders = ",".join("?" * len(missing))
         cur.execute(
-            "SELECT name, state, redeemed_at FROM users WHERE phone = ?",
-            (phone,)
+            f"SELECT phone, name, state, redeemed_at FROM users WHERE phone IN ({placeholders})",
+            missing,
         )
-        return cur.fetchone()  # (name, state, redeemed_at)
+        for phone, name, state, redeemed_at in cur.fetchall():
+            loaded[phone] = (name, state, redeemed_at)
+
+    fill_cached_users(loaded)
+    users.update(loaded)
+    return users
 
 
+@db_timed
 def upsert_user(phone: str, state: str, name: str | None = None):
     with get_conn() as conn:
         cur = conn.cursor()
@@ -138,12 +463,64 @@ def upsert_user(phone: str, state: str, name: str | None = None):
             DO UPDATE SET
                 state = excluded.state,
                 name = COALESCE(excluded.name, users.name)
+            RETURNING name, state, redeemed_at
         """,
             (phone, name, state),
         )
+        user = cur.fetchone()
         conn.commit()
+        set_cached_user(phone, user)
+
+
+@db_timed
+def get_stats(hours: int = 24) -> dict:
+    """Per-state user counts and the last `hours` hourly buckets (no scans)."""
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    since = (now - timedelta(hours=hours - 1)).strftime("%Y-%m-%dT%H:00:00Z")
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT state, users FROM user_state_counts")
+        states = dict(cur.fetchall())
+
+        cur.execute(
+            "SELECT hour, event, count FROM hourly_stats WHERE hour >= ? ORDER BY hour",
+            (since,),
+        )
+        rows = cur.fetchall()
+
+    hourly = {}
+    for hour, event, count in rows:
+        hourly.setdefault(hour, {"hour": hour, "issued": 0, "redeemed": 0})[event] = count
 
+    return {
+        "states": states,
+        "total_users": sum(states.values()),
+        "hourly": list(hourly.values()),
+    }
 
+
+@db_timed
+def claim_message(message_id: str) -> bool:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT OR IGNORE INTO processed_messages (id, seen_at) VALUES (?, ?)",
+            (message_id, datetime.now(timezone.utc).isoformat()),
+        )
+        conn.commit()
+        return cur.rowcount == 1
+
+
+@db_timed
+def release_message_claim(message_id: str):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM processed_messages WHERE id = ?", (message_id,))
+        conn.commit()
+
+
+@db_timed
 def redeem_user(phone: str) -> str:
     with get_conn() as conn:
         cur = conn.cursor()
@@ -182,5 +559,195 @@ def redeem_user(phone: str) -> str:
         )
 
         conn.commit()
+        invalidate_user(phone)
         return "REDEEMED"
 
+
+@db_timed
+def redeem_users(scans) -> list:
+    """
+    Redeem many (phone, redeemed_at) scans in one BEGIN IMMEDIATE.
+
+    Results line up with `scans` and use redeem_user's vocabulary; a
+    phone scanned twice in the batch is REDEEMED once, then
+    ALREADY_REDEEMED.
+    """
+    scans = list(scans)
+    if not scans:
+        return []
+
+    phones = list({phone for phone, _ in scans})
+    placeholders = ",".join("?" * len(phones))
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+
+        cur.execute(
+            f"SELECT phone, state FROM users WHERE phone IN ({placeholders})",
+            phones,
+        )
+        states = dict(cur.fetchall())
+
+        results, updates = [], []
+        for phone, redeemed_at in scans:
+            state = states.get(phone)
+
+            if state is None:
+                results.append("NOT_FOUND")
+            elif state == "REDEEMED":
+                results.append("ALREADY_REDEEMED")
+            elif state != "COMPLETED":
+                results.append("NOT_ELIGIBLE")
+            else:
+                states[phone] = "REDEEMED"
+                updates.append((redeemed_at, phone))
+                results.append("REDEEMED")
+
+        if not updates:
+            conn.rollback()
+            return results
+
+        cur.executemany(
+            """
+            UPDATE users
+            SET state = 'REDEEMED',
+                redeemed_at = ?
+            WHERE phone = ?
+            """,
+            updates,
+        )
+
+        conn.commit()
+
+    invalidate_users([phone for _, phone in updates])
+    return results
+
+
+
+@db_timed
+def clear_coupon_outbox(phone: str):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM coupon_outbox WHERE phone = ?", (phone,))
+        conn.commit()
+
+
+@db_timed
+def claim_coupon_outbox(granted_before: str, limit: int = 500) -> list:
+    """
+    Take (phone, name, granted_at) rows granted before `granted_before`.
+
+    The rows are deleted as they are read, so concurrent relays in other
+    processes never hand out the same coupon twice.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(
+            """
+            DELETE FROM coupon_outbox
+            WHERE phone IN (
+                SELECT phone FROM coupon_outbox
+                WHERE granted_at < ?
+                ORDER BY granted_at
+                LIMIT ?
+            )
+            RETURNING phone, name, granted_at
+            """,
+            (granted_before, limit),
+        )
+        rows = cur.fetchall()
+        conn.commit()
+        return rows
+
+
+@db_timed
+def restore_coupon_outbox(rows):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.executemany(
+            "INSERT OR IGNORE INTO coupon_outbox (phone, name, granted_at) VALUES (?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+
+
+@db_timed
+def complete_signup(phone: str, name: str) -> str:
+    """Reserve a coupon, mark the user received and complete them atomically."""
+    if not _redis_quota_enabled():
+        return _complete_signup(phone, name, reserved=False)
+
+    # Quota lives in Redis: reserve first so an exhausted quota never
+    # takes the SQLite write lock, and hand the slot back if unused.
+    if not reserve_quota():
+        return "QUOTA_EXHAUSTED"
+
+    try:
+        result = _complete_signup(phone, name, reserved=True)
+    except Exception:
+        release_quota()
+        raise
+
+    if result != "GRANTED":
+        release_quota()
+        return result
+
+    try:
+        write_back_quota()
+    except Exception:
+        # The grant already committed (SQLite or Redis may fail here);
+        # Redis stays authoritative and the timer retries the write-back.
+        logger.exception("🔥 Quota write-back failed")
+    return result
+
+
+def _complete_signup(phone: str, name: str, reserved: bool) -> str:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+
+        cur.execute("SELECT 1 FROM sent_users WHERE phone = ?", (phone,))
+        if cur.fetchone() is not None:
+            cur.execute(
+                "UPDATE users SET state = 'COMPLETED' WHERE phone = ?",
+                (phone,)
+            )
+            conn.commit()
+            invalidate_user(phone)
+            return "ALREADY_RECEIVED"
+
+        if not reserved:
+            cur.execute(
+                """
+                UPDATE quota
+                SET sent_images = sent_images + 1
+                WHERE id = 1 AND sent_images < max_images
+                """
+            )
+            if cur.rowcount == 0:
+                conn.rollback()
+                return "QUOTA_EXHAUSTED"
+
+        cur.execute("INSERT INTO sent_users (phone) VALUES (?)", (phone,))
+        cur.execute(
+            "INSERT OR REPLACE INTO coupon_outbox (phone, name, granted_at) VALUES (?, ?, ?)",
+            (phone, name, datetime.now(timezone.utc).isoformat()),
+        )
+        cur.execute(
+            """
+            INSERT INTO users (phone, name, state)
+            VALUES (?, ?, 'COMPLETED')
+            ON CONFLICT(phone)
+            DO UPDATE SET
+                state = excluded.state,
+                name = excluded.name
+            """,
+            (phone, name),
+        )
+
+        conn.commit()
+        invalidate_user(phone)
+        return "GRANTED"
@@ -0,0 +1,42 @@
+import logging
+
+import redis
+
+from app.config import Config
+from app.db import claim_message, release_message_claim
+from app.tasks.queue import get_redis
+
+logger = logging.getLogger("whatsapp_dedup")
+
+MESSAGE_KEY = "webhook_msg:{}"
+
+
+def first_delivery(message_id: str) -> bool:
+    """True the first time a provider message id is seen, False on retries."""
+    if not message_id:
+        return True
+
+    try:
+        return bool(get_redis().set(
+            MESSAGE_KEY.format(message_id), 1, nx=True, ex=Config.DEDUP_TTL
+        ))
+    except redis.RedisError:
+        logger.warning("⚠️ Redis dedup unavailable, falling back to SQLite")
+        return claim_message(message_id)
+
+
+def forget_delivery(message_id: str):
+    """Drop the claim so a provider retry can process the message again."""
+    if not message_id:
+        return
+
+    try:
+        get_redis().delete(MESSAGE_KEY.format(message_id))
+    except redis.RedisError:
+        pass
+
+    # Called from error paths: a locked DB must not hide the original error
+    try:
+        release_message_claim(message_id)
+    except Exception:
+        logger.exception(f"🔥 Could not release claim → {message_id}")
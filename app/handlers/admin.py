@@ -1,23 +1,117 @@
-from flask import Blueprint, render_template, request, redirect, url_for
-from app.db import get_quota, update_max_quota
+import functools
+import hmac
+
+from flask import (
+    Blueprint, Response, render_template, request, redirect, url_for, jsonify,
+    stream_with_context,
+)
+from app.config import Config
+from app.db import get_quota, get_stats, update_max_quota
+from app.tasks.export import FORMATS, TABLES
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
 
-@admin_bp.route("/quota", methods=["GET", "POST"])
-def quota():
-    if request.method == "POST":
-        new_quota = request.form.get("quota")
+# -------------------------------
+# Auth for writes and exports (nginx proxies /admin publicly)
+# -------------------------------
+def require_admin_token(view):
+    """
+    Allow only requests carrying ADMIN_TOKEN (X-Admin-Token header, or an
+    admin_token form field for the HTML page); disabled while it is unset.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get("X-Admin-Token") or request.form.get("admin_token", "")
+        if not Config.ADMIN_TOKEN or not hmac.compare_digest(
+            token.encode(), Config.ADMIN_TOKEN.encode()
+        ):
+            return jsonify({"status": "forbidden"}), 403
+        return view(*args, **kwargs)
 
-        if new_quota and new_quota.isdigit():
-            update_max_quota(int(new_quota))
+    return wrapper
 
-        return redirect(url_for("admin.quota"))
 
+@admin_bp.route("/quota", methods=["GET"])
+def quota():
     max_images, sent_images = get_quota()
 
     return render_template(
         "admin.html",
         max_images=max_images,
-        sent_images=sent_images
+        sent_images=sent_images,
+        stats=get_stats(hours=24),
+    )
+
+
+@admin_bp.route("/quota", methods=["POST"])
+@require_admin_token
+def update_quota():
+    new_quota = request.form.get("quota")
+
+    if new_quota and new_quota.isdigit():
+        update_max_quota(int(new_quota))
+
+    return redirect(url_for("admin.quota"))
+
+
+# -------------------------------
+# JSON: QUOTA (reads/writes through the active backend)
+# -------------------------------
+def _quota_json():
+    max_images, sent_images = get_quota()
+
+    return jsonify({
+        "backend": Config.QUOTA_BACKEND,
+        "max_images": max_images,
+        "sent_images": sent_images,
+        "remaining": max(max_images - sent_images, 0),
+    })
+
+
+@admin_bp.route("/api/quota", methods=["GET"])
+def quota_api():
+    return _quota_json()
+
+
+@admin_bp.route("/api/quota", methods=["POST"])
+@require_admin_token
+def update_quota_api():
+    data = request.get_json(silent=True) or {}
+    new_quota = data.get("max_images")
+
+    if not isinstance(new_quota, int) or isinstance(new_quota, bool) or new_quota < 0:
+        return jsonify({"status": "invalid_max_images"}), 400
+
+    update_max_quota(new_quota)
+    return _quota_json()
+
+
+# -------------------------------
+# JSON: CAMPAIGN STATS (trigger-maintained aggregates)
+# -------------------------------
+@admin_bp.route("/api/stats", methods=["GET"])
+def stats_api():
+    hours = request.args.get("hours", 24, type=int)
+    return jsonify(get_stats(hours=min(max(hours, 1), 24 * 31)))
+
+
+# -------------------------------
+# EXPORT: users / sent_users as CSV or NDJSON (streamed page by page)
+# -------------------------------
+@admin_bp.route("/export/<table>", methods=["GET"])
+@require_admin_token
+def export(table):
+    fmt = request.args.get("format", "csv")
+
+    if table not in TABLES or fmt not in FORMATS:
+        return jsonify({"status": "invalid_export"}), 400
+
+    mimetype, encode = FORMATS[fmt]
+    states = request.args.getlist("state") or None
+
+    return Response(
+        stream_with_context(encode(table, states, 5000)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={table}.{fmt}"},
     )
@@ -0,0 +1,14 @@
+from flask import Blueprint, Response
+
+from app.metrics import render_latest
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+# -------------------------------
+# PROMETHEUS SCRAPE (internal network only, not routed by nginx)
+# -------------------------------
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    body, content_type = render_latest()
+    return Response(body, content_type=content_type)
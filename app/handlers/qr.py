@@ -1,13 +1,33 @@
-from flask import Blueprint, jsonify
-from app.db import get_user, redeem_user
+from datetime import datetime, timezone
+
+from flask import Blueprint, jsonify, request
+from app.config import Config
+from app.db import get_user, redeem_user, redeem_users
+from app.qr_token import phone_from_code
 
 qr_bp = Blueprint("qr", __name__)
 
+# Both endpoints take the raw scanned QR value: a signed coupon token, or
+# (while QR_ALLOW_UNSIGNED is on) the bare phone digits of older coupons.
+# Anything that fails verification is rejected before touching the DB.
+
+
+def _invalid_code():
+    return jsonify({
+        "status": "invalid_code",
+        "can_redeem": False
+    }), 400
+
+
 # -------------------------------
 # READ-ONLY: QR STATUS
 # -------------------------------
-@qr_bp.route("/api/qr/status/<phone>", methods=["GET"])
-def qr_status(phone):
+@qr_bp.route("/api/qr/status/<code>", methods=["GET"])
+def qr_status(code):
+    phone = phone_from_code(code)
+    if not phone:
+        return _invalid_code()
+
     user = get_user(phone)
 
     if not user:
@@ -28,19 +48,92 @@ def qr_status(phone):
 
 
 # -------------------------------
-# MUTATION: REDEEM
+# MUTATION: REDEEM (no status call needed first)
 # -------------------------------
-@qr_bp.route("/api/qr/redeem/<phone>", methods=["POST"])
-def qr_redeem(phone):
+@qr_bp.route("/api/qr/redeem/<code>", methods=["POST"])
+def qr_redeem(code):
+    phone = phone_from_code(code)
+    if not phone:
+        return _invalid_code()
+
     result = redeem_user(phone)
 
     if result == "NOT_FOUND":
-        return jsonify({"status": "not_found"}), 404
+        return jsonify({"status": "not_found", "phone": phone}), 404
 
     if result == "NOT_ELIGIBLE":
-        return jsonify({"status": "not_eligible"}), 400
+        return jsonify({"status": "not_eligible", "phone": phone}), 400
 
     if result == "ALREADY_REDEEMED":
-        return jsonify({"status": "already_redeemed"}), 200
+        return jsonify({"status": "already_redeemed", "phone": phone}), 200
+
+    return jsonify({"status": "redeemed", "phone": phone}), 200
+
+
+# -------------------------------
+# MUTATION: BATCH REDEEM (offline sync)
+# -------------------------------
+def _scan_time(value, now):
+    """Client scan time as UTC ISO-8601; None if unparseable."""
+    if value is None:
+        return now.isoformat()
+
+    try:
+        scanned_at = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+    if scanned_at.tzinfo is None:
+        scanned_at = scanned_at.replace(tzinfo=timezone.utc)
 
-    return jsonify({"status": "redeemed"}), 200
+    # A scanner clock running ahead must not stamp redemptions in the future
+    return min(scanned_at.astimezone(timezone.utc), now).isoformat()
+
+
+@qr_bp.route("/api/qr/redeem-batch", methods=["POST"])
+def qr_redeem_batch():
+    """
+    Body: {"scans": [{"id": ..., "code": ..., "scanned_at": ISO-8601}, ...]}
+
+    All valid scans are applied in one transaction, in order. Results keep
+    the request order and echo each scan's optional client `id`.
+    """
+    data = request.get_json(silent=True)
+    scans = data.get("scans") if isinstance(data, dict) else None
+
+    if not isinstance(scans, list):
+        return jsonify({"status": "invalid_scans"}), 400
+
+    if len(scans) > Config.QR_BATCH_MAX:
+        return jsonify({"status": "too_many_scans", "max": Config.QR_BATCH_MAX}), 400
+
+    now = datetime.now(timezone.utc)
+    results, pending = [], []
+
+    for scan in scans:
+        scan = scan if isinstance(scan, dict) else {}
+        result = {"id": scan.get("id")}
+        results.append(result)
+
+        code = scan.get("code")
+        phone = phone_from_code(code) if isinstance(code, str) else None
+        if not phone:
+            result["status"] = "invalid_code"
+            continue
+
+        result["phone"] = phone
+        redeemed_at = _scan_time(scan.get("scanned_at"), now)
+        if redeemed_at is None:
+            result["status"] = "invalid_timestamp"
+            continue
+
+        pending.append((result, phone, redeemed_at))
+
+    outcomes = redeem_users((phone, at) for _, phone, at in pending)
+    for (result, _, _), outcome in zip(pending, outcomes):
+        result["status"] = outcome.lower()
+
+    return jsonify({
+        "redeemed": sum(r["status"] == "redeemed" for r in results),
+        "results": results,
+    })
@@ -1,20 +1,14 @@
 import logging
-import os
 from flask import Blueprint, request, jsonify
-from PIL import Image, ImageDraw, ImageFont
-import qrcode
-import time
 
-from app.tasks.queue import enqueue
 from app.config import Config
-from app.db import (
-    get_user,
-    upsert_user,
-    has_user_received,
-    mark_user_received,
-    can_send_image,
-    increment_sent,
-)
+from app.metrics import HANDLE_EVENT_SECONDS, WEBHOOK_SECONDS
+from app.tasks.ingress import publish
+from app.constants import COUPON_CAPTION
+from app.tasks.outbox import coupon_enqueued, coupon_task
+from app.tasks.queue import RENDER_QUEUE, after_flush, batch, enqueue
+from app.db import get_user, get_users, upsert_user, complete_signup
+from app.dedup import first_delivery, forget_delivery
 
 webhook_bp = Blueprint("webhook", __name__)
 
@@ -27,109 +21,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger("whatsapp_webhook")
 
-# -------------------------------------------------
-# Project paths
-# -------------------------------------------------
-BASE_DIR = os.path.abspath(
-    os.path.join(os.path.dirname(__file__), "..", "..")
-)
-
-STATIC_DIR = os.path.join(BASE_DIR, "static")
-IMAGE_DIR = os.path.join(STATIC_DIR, "images")
-GENERATED_DIR = os.path.join(IMAGE_DIR, "generated")
-
-BASE_COUPON_PATH = os.path.join(IMAGE_DIR, "base_coupon.png")
-FONT_PATH = os.path.join(STATIC_DIR, "fonts", "DejaVuSans-Bold.ttf")
-
-logger.info(f"📁 BASE_DIR={BASE_DIR}")
-logger.info(f"🖼️ BASE_COUPON_PATH={BASE_COUPON_PATH}")
-logger.info(f"🔤 FONT_PATH={FONT_PATH}")
-
-# -------------------------------------------------
-# Image generation
-# -------------------------------------------------
-
-def generate_coupon(name: str, phone: str) -> str:
-    logger.info(f"🧩 Generating coupon for {phone} | name='{name}'")
-
-    os.makedirs(GENERATED_DIR, exist_ok=True)
-
-    img = Image.open(BASE_COUPON_PATH).convert("RGB")
-    draw = ImageDraw.Draw(img)
-
-    # -----------------------------
-    # Text config (LOCKED)
-    # -----------------------------
-    FONT_SIZE = 30
-    Y_NAME = 1000
-    Y_PHONE = 1050
-    LEFT_PERCENT = 0.25
-
-    # -----------------------------
-    # QR config (LOCKED)
-    # -----------------------------
-    QR_SIZE = 260
-    TEXT_TO_QR_GAP = 110
-
-    font = ImageFont.truetype(FONT_PATH, FONT_SIZE)
-
-    name = name.strip()[:25]
-    safe_phone = "".join(c for c in phone if c.isdigit())
-
-    img_width, _ = img.size
-    x_text = int(img_width * LEFT_PERCENT)
-
-    # -----------------------------
-    # Draw text
-    # -----------------------------
-    draw.text((x_text, Y_NAME), name, fill="white", font=font)
-    draw.text((x_text, Y_PHONE), f"Mobile: {safe_phone}", fill="white", font=font)
-
-    # -----------------------------
-    # Generate QR
-    # -----------------------------
-    qr_data = f"{safe_phone}"
-
-    qr = qrcode.QRCode(
-        version=None,
-        error_correction=qrcode.constants.ERROR_CORRECT_Q,
-        box_size=10,
-        border=2,
-    )
-    qr.add_data(qr_data)
-    qr.make(fit=True)
-
-    qr_img = qr.make_image(
-        fill_color="black",
-        back_color="white"
-    ).convert("RGB")
-
-    qr_img = qr_img.resize((QR_SIZE, QR_SIZE), Image.LANCZOS)
-
-    # -----------------------------
-    # Center-align QR
-    # -----------------------------
-    qr_x = (img_width - QR_SIZE) // 2
-    qr_y = Y_PHONE + TEXT_TO_QR_GAP
-
-    img.paste(qr_img, (qr_x, qr_y))
-
-    # -----------------------------
-    # Save (UNIQUE filename → no cache issues)
-    # -----------------------------
-    timestamp = int(time.time())
-    filename = f"coupon_{safe_phone}_{timestamp}.png"
-    output_path = os.path.join(GENERATED_DIR, filename)
-    img.save(output_path)
-
-    image_url = f"{Config.BASE_URL}/static/images/generated/{filename}"
-
-    logger.info(f"✅ Coupon generated → {output_path}")
-    logger.info(f"🌍 Public image URL → {image_url}")
-
-    return image_url
-
-
 # -------------------------------------------------
 # Queue helpers
 # -------------------------------------------------
@@ -152,10 +43,18 @@ def send_image(to, image_url, caption=""):
     })
 
 
+def render_and_send_coupon(to, name, caption=COUPON_CAPTION):
+    logger.info(f"🎨 Queue coupon render → {to}")
+    enqueue(coupon_task(to, name, caption), queue=RENDER_QUEUE)
+    # The grant's outbox row stays until the task is really in Redis
+    after_flush(lambda: coupon_enqueued(to))
+
+
 # -------------------------------------------------
 # Webhook endpoint
 # -------------------------------------------------
 @webhook_bp.route("/webhook", methods=["POST"])
+@WEBHOOK_SECONDS.labels(mode=Config.WEBHOOK_MODE).time()
 def webhook():
     data = request.get_json(silent=True)
 
@@ -164,108 +63,211 @@ def webhook():
         return jsonify({"status": "ignored"}), 200
 
     logger.info("📥 Webhook received")
-    handle_event(data)
+
+    if Config.WEBHOOK_MODE == "queue":
+        # Accept-and-ack: app.tasks.ingress runs the state machine
+        if not isinstance(data, dict) or not isinstance(data.get("entry"), list):
+            logger.warning("⚠️ Malformed webhook payload")
+            return jsonify({"status": "ignored"}), 200
+
+        publish(data)
+        return jsonify({"status": "queued"}), 200
+
+    try:
+        handle_event(data)
+    except DeliveryFailed as e:
+        # Failed messages were released; a 5xx makes the provider retry them
+        logger.error(f"🔁 {e}; asking the provider to retry")
+        return jsonify({"status": "retry"}), 500
     return jsonify({"status": "ok"}), 200
 
 
 # -------------------------------------------------
 # Core logic
 # -------------------------------------------------
+class DeliveryFailed(Exception):
+    """Some messages of a delivery failed and were released for a retry."""
+
+
+def iter_events(payload):
+    """Yield every (kind, item) in a possibly batched webhook delivery."""
+    for entry in payload.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+
+            for status in value.get("statuses") or []:
+                yield "status", status
+
+            for message in value.get("messages") or []:
+                yield "message", message
+
+
+@HANDLE_EVENT_SECONDS.time()
 def handle_event(payload):
+    messages = []
+
     try:
-        value = payload["entry"][0]["changes"][0]["value"]
+        for kind, item in iter_events(payload):
+            if kind == "status":
+                handle_status(item)
+            else:
+                messages.append(item)
+    except Exception:
+        logger.exception("🔥 Malformed webhook payload")
+        return
 
-        if "messages" not in value:
-            logger.info("ℹ️ No messages in webhook")
-            return
+    if not messages:
+        logger.info("ℹ️ No messages in webhook")
+        return
+
+    # Provider retries of already handled deliveries stop here
+    fresh = []
+    try:
+        for message in messages:
+            if first_delivery(message.get("id")):
+                fresh.append(message)
+            else:
+                logger.info(f"🔁 Duplicate delivery ignored → {message.get('id')}")
+    except Exception:
+        logger.exception("🔥 Dedup claim failed")
+        _release_all(fresh)
+        raise DeliveryFailed("dedup claim failed")
 
-        message = value["messages"][0]
-        from_number = message["from"]
-        msg_type = message["type"]
+    # One lookup for every sender in the delivery
+    try:
+        users = get_users({m.get("from") for m in fresh if m.get("from")})
+    except Exception:
+        logger.exception("🔥 User lookup failed")
+        _release_all(fresh)
+        raise DeliveryFailed("user lookup failed")
+
+    failed = 0
+
+    for message in fresh:
+        from_number = message.get("from")
+
+        # A sender's later messages must see the state the earlier ones set
+        try:
+            user = users.pop(from_number) if from_number in users else get_user(from_number)
+        except Exception:
+            logger.exception("🔥 User lookup failed")
+            forget_delivery(message.get("id"))
+            failed += 1
+            continue
 
-        logger.info(f"📨 Incoming message from {from_number} | type={msg_type}")
+        if not handle_message(message, user):
+            failed += 1
 
-        user = get_user(from_number)
-        state = user[1] if user else "START"
+    if failed:
+        raise DeliveryFailed(f"{failed} of {len(fresh)} messages failed")
 
-        logger.info(f"👤 User state → {state}")
 
-        text_body = ""
-        if msg_type == "text":
-            text_body = message["text"]["body"].strip().lower()
-            logger.info(f"💬 Text body → '{text_body}'")
+def _release_all(messages):
+    """Nothing was handled yet: release every claim so the retry runs."""
+    for message in messages:
+        forget_delivery(message.get("id"))
 
-        # -------------------------------------------------
-        # START GATE
-        # -------------------------------------------------
-        if state == "START":
-            if msg_type != "text":
-                logger.info("🚫 START: non-text message ignored")
-                return
 
-            if "khalifa melur" not in text_body:
-                logger.info("🚫 START: keyword mismatch")
-                return
+def handle_status(status):
+    logger.info(
+        f"📬 Status {status.get('status')} → {status.get('recipient_id')} | {status.get('id')}"
+    )
+
 
-            upsert_user(from_number, state="ASKED_NAME")
-            logger.info("➡️ State updated → ASKED_NAME")
+def handle_message(message, user) -> bool:
+    """
+    Run one message through the state machine; False if it failed.
 
-            send_text(
-                from_number,
-                "வணக்கம் கலிபா ஹைடெக் மொபைல்ஸ் திறப்பு விழா ஆஃபர் பெற உங்களது பெயரை உள்ளிடவும்"
-            )
+    The message's replies are flushed inside its own error handling, so a
+    failed push releases the dedup claim just like a failed DB write and
+    the provider's retry is processed instead of dropped as a duplicate.
+    A coupon granted before the failed push is not lost with it: its
+    coupon_outbox row stays, and app.tasks.outbox relays the render.
+    """
+    message_id = message.get("id")
+    try:
+        with batch():
+            _advance_state(message, user)
+    except Exception:
+        logger.exception("🔥 Webhook error")
+        forget_delivery(message_id)
+        return False
+    return True
+
+
+def _advance_state(message, user):
+    from_number = message["from"]
+    msg_type = message["type"]
+
+    logger.info(f"📨 Incoming message from {from_number} | type={msg_type}")
+
+    state = user[1] if user else "START"
+
+    logger.info(f"👤 User state → {state}")
+
+    text_body = ""
+    if msg_type == "text":
+        text_body = message["text"]["body"].strip().lower()
+        logger.info(f"💬 Text body → '{text_body}'")
+
+    # -------------------------------------------------
+    # START GATE
+    # -------------------------------------------------
+    if state == "START":
+        if msg_type != "text":
+            logger.info("🚫 START: non-text message ignored")
             return
 
-        # -------------------------------------------------
-        # NAME RECEIVED
-        # -------------------------------------------------
-        if state == "ASKED_NAME" and msg_type == "text":
-            name = message["text"]["body"].strip()
-            logger.info(f"📝 Name received → '{name}'")
-
-            if has_user_received(from_number):
-                logger.info("⚠️ User already received coupon")
-                send_text(from_number, "ℹ️ நீங்கள் ஏற்கனவே கூப்பனை பெற்றுவிட்டீர்கள்.")
-                upsert_user(from_number, state="COMPLETED")
-                return
-
-            if not can_send_image():
-                logger.warning("🚫 Daily coupon limit reached")
-                send_text(from_number, "🚫 இன்று கூப்பன் அளவு முடிந்துவிட்டது.")
-                return
-
-            upsert_user(from_number, state="COMPLETED", name=name)
-            logger.info("➡️ State updated → COMPLETED")
-
-            send_text(
-                from_number,
-                "🎉 கலிபா ஹைடெக் மொபைல்ஸ் திறப்பு விழா ஆஃபர் உறுதி செய்யப்பட்டது!"
-            )
-
-            image_url = generate_coupon(name, from_number)
-
-            send_image(
-                from_number,
-                image_url,
-                "🎟️ இந்த கூப்பனை கடையில் காட்டவும்"
-            )
-
-            mark_user_received(from_number)
-            increment_sent()
-            logger.info("📊 Coupon marked as sent")
+        if "khalifa melur" not in text_body:
+            logger.info("🚫 START: keyword mismatch")
             return
 
-        # -------------------------------------------------
-        # COMPLETED
-        # -------------------------------------------------
-        if state == "COMPLETED":
-            if "khalifa melur" not in text_body:
-                logger.info("🚫 START: keyword mismatch")
-                return
-            
-            logger.info("ℹ️ User already completed flow")
-            send_text(from_number, "நீங்கள் ஏற்கனவே கூப்பனுக்கு பதிவு செய்துவிட்டீர்கள்!")
+        upsert_user(from_number, state="ASKED_NAME")
+        logger.info("➡️ State updated → ASKED_NAME")
+
+        send_text(
+            from_number,
+            "வணக்கம் கலிபா ஹைடெக் மொபைல்ஸ் திறப்பு விழா ஆஃபர் பெற உங்களது பெயரை உள்ளிடவும்"
+        )
+        return
+
+    # -------------------------------------------------
+    # NAME RECEIVED
+    # -------------------------------------------------
+    if state == "ASKED_NAME" and msg_type == "text":
+        name = message["text"]["body"].strip()
+        logger.info(f"📝 Name received → '{name}'")
+
+        result = complete_signup(from_number, name)
+
+        if result == "ALREADY_RECEIVED":
+            logger.info("⚠️ User already received coupon")
+            send_text(from_number, "ℹ️ நீங்கள் ஏற்கனவே கூப்பனை பெற்றுவிட்டீர்கள்.")
             return
 
-    except Exception:
-        logger.exception("🔥 Webhook error")
+        if result == "QUOTA_EXHAUSTED":
+            logger.warning("🚫 Daily coupon limit reached")
+            send_text(from_number, "🚫 இன்று கூப்பன் அளவு முடிந்துவிட்டது.")
+            return
+
+        logger.info("📊 Coupon reserved → State updated → COMPLETED")
+
+        send_text(
+            from_number,
+            "🎉 கலிபா ஹைடெக் மொபைல்ஸ் திறப்பு விழா ஆஃபர் உறுதி செய்யப்பட்டது!"
+        )
+
+        render_and_send_coupon(from_number, name)
+        return
+
+    # -------------------------------------------------
+    # COMPLETED
+    # -------------------------------------------------
+    if state == "COMPLETED":
+        if "khalifa melur" not in text_body:
+            logger.info("🚫 START: keyword mismatch")
+            return
+        
+        logger.info("ℹ️ User already completed flow")
+        send_text(from_number, "நீங்கள் ஏற்கனவே கூப்பனுக்கு பதிவு செய்துவிட்டீர்கள்!")
+        return
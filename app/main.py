@@ -2,18 +2,25 @@ from flask import Flask
 from app.config import Config
 from app.handlers.webhook import webhook_bp
 from app.handlers.admin import admin_bp
-from app.db import init_db
+from app.db import init_db, start_quota_writeback
 from app.handlers.qr import qr_bp
+from app.handlers.metrics import metrics_bp
+from app.qr_token import require_signing_key
+from app.tasks.outbox import start_outbox_relay
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    require_signing_key()
     init_db()
+    start_quota_writeback()
+    start_outbox_relay()
 
     app.register_blueprint(webhook_bp)
     app.register_blueprint(admin_bp)
     app.register_blueprint(qr_bp)
+    app.register_blueprint(metrics_bp)
 
     return app
 
@@ -0,0 +1,142 @@
+import functools
+import logging
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger("whatsapp_metrics")
+
+# Set PROMETHEUS_MULTIPROC_DIR (an empty dir per container) for gunicorn and
+# the process pools, so one scrape sees every process.
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# -------------------------------------------------
+# Histograms
+# -------------------------------------------------
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+SLOW_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+WEBHOOK_SECONDS = Histogram(
+    "whatsapp_webhook_seconds", "POST /webhook handling time",
+    ["mode"], buckets=FAST_BUCKETS,
+)
+HANDLE_EVENT_SECONDS = Histogram(
+    "whatsapp_handle_event_seconds", "handle_event time per delivery",
+    buckets=FAST_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    "whatsapp_db_seconds", "app.db call time",
+    ["call"], buckets=FAST_BUCKETS,
+)
+ENQUEUE_SECONDS = Histogram(
+    "whatsapp_enqueue_seconds", "Redis round trip per enqueue flush",
+    buckets=FAST_BUCKETS,
+)
+ENQUEUED_TOTAL = Counter(
+    "whatsapp_enqueued_tasks_total", "Tasks pushed to a queue", ["queue"],
+)
+COUPON_RENDER_SECONDS = Histogram(
+    "coupon_render_seconds", "Coupon compose time (template + patches)",
+    buckets=SLOW_BUCKETS,
+)
+COUPON_ENCODE_SECONDS = Histogram(
+    "coupon_encode_seconds", "Coupon encode time", ["format"],
+    buckets=SLOW_BUCKETS,
+)
+USER_CACHE_LOOKUPS = Counter(
+    "whatsapp_user_cache_lookups_total", "User state cache lookups", ["result"],
+)
+USER_CACHE_ERRORS = Counter(
+    "whatsapp_user_cache_errors_total", "User state cache backend failures",
+)
+PROVIDER_SECONDS = Histogram(
+    "whatsapp_provider_seconds", "Provider HTTP call time per attempt",
+    ["endpoint", "status"], buckets=SLOW_BUCKETS,
+)
+
+
+def db_timed(fn):
+    """Observe every call of an app.db function under its own name."""
+    histogram = DB_SECONDS.labels(call=fn.__name__)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with histogram.time():
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+# -------------------------------------------------
+# Scrape-time gauges (read live, never stored)
+# -------------------------------------------------
+class BacklogCollector:
+    """Queue depths and quota remaining, read from Redis/SQLite per scrape."""
+
+    def collect(self):
+        from app.db import get_quota
+        from app.tasks.queue import QUEUE, RENDER_QUEUE, dead_key, get_redis
+
+        depth = GaugeMetricFamily(
+            "whatsapp_queue_depth", "Tasks waiting in a Redis queue", labels=["queue"]
+        )
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            names = (QUEUE, RENDER_QUEUE, dead_key(QUEUE), dead_key(RENDER_QUEUE))
+            for name in names:
+                pipe.llen(name)
+            for name, length in zip(names, pipe.execute()):
+                depth.add_metric([name], length)
+        except Exception:
+            logger.exception("🔥 Queue depth scrape failed")
+        yield depth
+
+        remaining = GaugeMetricFamily(
+            "whatsapp_quota_remaining", "Coupons left before the quota is exhausted"
+        )
+        try:
+            max_images, sent_images = get_quota()
+            remaining.add_metric([], max(max_images - sent_images, 0))
+        except Exception:
+            logger.exception("🔥 Quota scrape failed")
+        yield remaining
+
+
+def _registry(with_backlog: bool):
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    if with_backlog:
+        registry.register(BacklogCollector())
+    return registry
+
+
+_app_registry = None
+
+
+def render_latest():
+    """(body, content type) for the app's /metrics endpoint."""
+    global _app_registry
+    if _app_registry is None:
+        _app_registry = _registry(with_backlog=True)
+    return generate_latest(_app_registry), CONTENT_TYPE_LATEST
+
+
+def start_exporter(port: int):
+    """Serve this process's (or, in multiprocess mode, the pool's) metrics."""
+    if not port:
+        return
+    start_http_server(port, registry=_registry(with_backlog=False))
+    logger.info(f"📈 Metrics exporter listening on :{port}")
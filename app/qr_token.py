@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import hmac
+import logging
+import time
+from typing import NamedTuple
+
+from app.config import Config
+
+logger = logging.getLogger("whatsapp_qr_token")
+
+# C1.<phone>.<campaign>.<issued at, base36>.<signature, base32>
+#
+# Upper-case letters, digits and "." only, so the QR encoder can use its
+# compact alphanumeric mode; the whole token fits a version 3 code.
+TOKEN_VERSION = "C1"
+SIGNATURE_BYTES = 10  # 80-bit truncated HMAC-SHA256
+
+# Issue times are floored to the hour so re-renders within the hour
+# produce the same QR (and render_qr_patch's cache still hits).
+ISSUE_RESOLUTION = 3600
+
+DEV_KEY = "dev_qr_key"
+
+
+class SigningKeyMissing(RuntimeError):
+    pass
+
+
+def _key() -> bytes:
+    """The signing key; raises rather than sign or verify with a guessable one."""
+    if Config.QR_SIGNING_KEY:
+        return Config.QR_SIGNING_KEY.encode()
+    if Config.QR_DEV_KEY:
+        return DEV_KEY.encode()
+    raise SigningKeyMissing("QR_SIGNING_KEY is not set (QR_DEV_KEY=1 for local use)")
+
+
+def require_signing_key():
+    """Refuse to start a process that signs or verifies coupons without a key."""
+    _key()
+    if not Config.QR_SIGNING_KEY:
+        logger.warning("⚠️ QR_DEV_KEY is on; coupons can be forged")
+    if Config.QR_ALLOW_UNSIGNED:
+        logger.warning("⚠️ QR_ALLOW_UNSIGNED is on; bare phone numbers redeem coupons")
+
+
+class QRClaims(NamedTuple):
+    phone: str
+    campaign: str
+    issued_at: int
+
+
+def _signature(payload: str) -> str:
+    digest = hmac.new(_key(), payload.encode(), hashlib.sha256).digest()
+    return base64.b32encode(digest[:SIGNATURE_BYTES]).decode()
+
+
+def _base36(value: int) -> str:
+    digits = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    out = ""
+    while True:
+        value, rem = divmod(value, 36)
+        out = digits[rem] + out
+        if not value:
+            return out
+
+
+def signing_key_id() -> str:
+    """Stable, non-reversible id of the signing key (for render fingerprints)."""
+    return _signature("key-id")[:8]
+
+
+def issue_epoch(now: float | None = None) -> str:
+    """
+    Window a reusable coupon file belongs to; "" while tokens never expire.
+
+    Windows last half the token lifetime, so a file reused anywhere in its
+    window still carries a token valid for at least that long again.
+    """
+    max_age = Config.QR_TOKEN_MAX_AGE_DAYS * 86400
+    if not max_age:
+        return ""
+    period = max(max_age // 2, ISSUE_RESOLUTION)
+    return str(int(time.time() if now is None else now) // period)
+
+
+def sign_qr(phone: str, issued_at: int | None = None) -> str:
+    if issued_at is None:
+        issued_at = int(time.time()) // ISSUE_RESOLUTION * ISSUE_RESOLUTION
+    payload = ".".join((
+        TOKEN_VERSION, phone, Config.QR_CAMPAIGN, _base36(issued_at)
+    ))
+    return f"{payload}.{_signature(payload)}"
+
+
+def verify_qr(code: str) -> QRClaims | None:
+    """Claims of a genuine, current-campaign token; None for anything else.
+
+    Pure CPU: forged or malformed codes are rejected without touching
+    SQLite or Redis.
+    """
+    parts = code.strip().upper().split(".")
+    if len(parts) != 5 or parts[0] != TOKEN_VERSION:
+        return None
+
+    version, phone, campaign, issued, signature = parts
+    payload = ".".join((version, phone, campaign, issued))
+
+    if not hmac.compare_digest(signature, _signature(payload)):
+        return None
+
+    if campaign != Config.QR_CAMPAIGN or not phone.isdigit():
+        return None
+
+    try:
+        issued_at = int(issued, 36)
+    except ValueError:
+        return None
+
+    max_age = Config.QR_TOKEN_MAX_AGE_DAYS * 86400
+    if max_age and time.time() - issued_at > max_age:
+        return None
+
+    return QRClaims(phone, campaign, issued_at)
+
+
+def phone_from_code(code: str) -> str | None:
+    """Phone a scanned QR value is good for, or None if it must be rejected.
+
+    Coupons sent before signing carried the bare phone digits; those are
+    only accepted while an operator has turned QR_ALLOW_UNSIGNED on.
+    """
+    claims = verify_qr(code)
+    if claims:
+        return claims.phone
+
+    if Config.QR_ALLOW_UNSIGNED and code.isdigit():
+        return code
+
+    return None
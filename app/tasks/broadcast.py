@@ -0,0 +1,145 @@
+"""Send one follow-up message to every user in the given states.
+
+    python -m app.tasks.broadcast --text "Offer ends tomorrow!"
+    python -m app.tasks.broadcast --state COMPLETED --image-url https://... --caption "..."
+    python -m app.tasks.broadcast --text "..." --resume   # continue an interrupted run
+
+Phones are streamed from SQLite a chunk at a time and pushed with one
+pipelined RPUSH per chunk. Pushing pauses while whatsapp_tasks is deeper
+than --max-queue-depth, so the worker (and its provider rate limit) sets
+the pace instead of the queue growing without bound.
+"""
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from app.db import get_stats, iter_pages
+from app.tasks.queue import QUEUE, enqueue_many, get_redis
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("broadcast")
+
+DEFAULT_CHECKPOINT = "broadcast.checkpoint"
+
+
+def build_task(phone: str, text: str | None, image_url: str | None, caption: str):
+    if image_url:
+        return {
+            "type": "send_image",
+            "to": phone,
+            "image_url": image_url,
+            "caption": caption,
+        }
+    return {"type": "send_text", "to": phone, "text": text}
+
+
+def wait_for_room(r, max_depth: int, poll: float = 1.0) -> float:
+    """Block while the send queue is over max_depth; returns seconds waited."""
+    waited = 0.0
+    while max_depth and r.llen(QUEUE) > max_depth:
+        time.sleep(poll)
+        waited += poll
+    return waited
+
+
+def broadcast(
+    states,
+    text: str | None,
+    image_url: str | None,
+    caption: str,
+    chunk_size: int,
+    max_depth: int,
+    checkpoint: Path,
+    resume: bool,
+    dry_run: bool,
+):
+    after = ""
+    if resume and checkpoint.exists():
+        after = checkpoint.read_text().strip()
+        logger.info(f"↩️ Resuming after phone {after}")
+    elif checkpoint.exists() and not dry_run:
+        checkpoint.unlink()
+
+    # O(1) from the trigger-maintained counters; exact unless resuming
+    counts = get_stats(hours=1)["states"]
+    total = sum(counts.get(state, 0) for state in states)
+
+    logger.info(f"📣 Broadcasting to ~{total} users in {', '.join(states)}")
+
+    r = get_redis()
+    sent = 0
+    throttled = 0.0
+    started = last_report = time.monotonic()
+
+    for page in iter_pages("users", ("phone",), states, chunk_size, after=after):
+        if not dry_run:
+            throttled += wait_for_room(r, max_depth)
+            enqueue_many(build_task(row[0], text, image_url, caption) for row in page)
+            # Whole chunk is in Redis: safe point to resume from
+            checkpoint.write_text(page[-1][0])
+
+        sent += len(page)
+
+        now = time.monotonic()
+        if now - last_report >= 5:
+            last_report = now
+            rate = sent / (now - started)
+            logger.info(
+                f"📈 {sent}/{total} enqueued | {rate:.0f}/s | throttled {throttled:.0f}s"
+            )
+
+    elapsed = time.monotonic() - started
+    rate = sent / elapsed if elapsed else 0
+    action = "Would enqueue" if dry_run else "Enqueued"
+    logger.info(
+        f"✅ {action} {sent} messages in {elapsed:.1f}s ({rate:.0f}/s, "
+        f"throttled {throttled:.0f}s)"
+    )
+    if not dry_run:
+        checkpoint.unlink(missing_ok=True)
+
+    return {"enqueued": sent, "seconds": elapsed, "per_second": rate, "throttled": throttled}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    message = parser.add_mutually_exclusive_group(required=True)
+    message.add_argument("--text")
+    message.add_argument("--image-url")
+    parser.add_argument("--caption", default="")
+    parser.add_argument(
+        "--state", action="append", dest="states",
+        help="user state to include (repeatable, default COMPLETED)",
+    )
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument(
+        "--max-queue-depth", type=int, default=20000,
+        help=f"pause while {QUEUE} holds more tasks than this (0 = never)",
+    )
+    parser.add_argument("--checkpoint", type=Path, default=Path(DEFAULT_CHECKPOINT))
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="skip users up to the phone stored in the checkpoint file",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="count only, enqueue nothing")
+    args = parser.parse_args(argv)
+
+    broadcast(
+        states=args.states or ["COMPLETED"],
+        text=args.text,
+        image_url=args.image_url,
+        caption=args.caption,
+        chunk_size=args.chunk_size,
+        max_depth=args.max_queue_depth,
+        checkpoint=args.checkpoint,
+        resume=args.resume,
+        dry_run=args.dry_run,
+    )
+
+
+# -------------------------------------------------
+# Entry
+# -------------------------------------------------
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Remove generated coupons that no live (COMPLETED) user still needs.
+
+    python -m app.tasks.coupon_gc --dry-run
+    python -m app.tasks.coupon_gc --grace-hours 24 --max-age-days 30
+"""
+import argparse
+import logging
+import os
+import time
+
+from app.coupon import GENERATED_DIR, coupon_key, normalize, render_fingerprint
+from app.db import iter_pages
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("coupon_gc")
+
+# Coupons plus temp files left behind by a renderer that died mid-write
+GC_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tmp")
+
+
+def live_keys(page_size: int = 5000) -> set:
+    """Content keys of every coupon a COMPLETED (unredeemed) user may show."""
+    fingerprint = render_fingerprint()
+    keys = set()
+
+    for page in iter_pages("users", ("phone", "name"), ["COMPLETED"], page_size):
+        for phone, name in page:
+            keys.add(coupon_key(*normalize(name or "", phone), fingerprint))
+
+    return keys
+
+
+def collect(grace_hours: float, max_age_days: float | None, dry_run: bool):
+    keep = live_keys()
+    now = time.time()
+    grace = grace_hours * 3600
+    max_age = max_age_days * 86400 if max_age_days is not None else None
+
+    removed = kept = freed = 0
+
+    for root, _, files in os.walk(GENERATED_DIR, topdown=False):
+        for filename in files:
+            if not filename.endswith(GC_EXTENSIONS):
+                continue
+
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            age = now - stat.st_mtime
+            key = filename.split(".", 1)[0]
+
+            # Just-rendered files may still be waiting for the provider fetch
+            expired = max_age is not None and age > max_age
+            if age < grace or (key in keep and not expired):
+                kept += 1
+                continue
+
+            removed += 1
+            freed += stat.st_size
+            if not dry_run:
+                os.remove(path)
+
+        # Drop emptied shard directories, never the root itself
+        if not dry_run and root != GENERATED_DIR and not os.listdir(root):
+            os.rmdir(root)
+
+    action = "Would remove" if dry_run else "Removed"
+    logger.info(
+        f"🧹 {action} {removed} coupons ({freed / 1e6:.1f} MB), kept {kept} "
+        f"for {len(keep)} live users"
+    )
+    return {"removed": removed, "kept": kept, "bytes_freed": freed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--grace-hours", type=float, default=24,
+        help="never delete files younger than this (default 24)",
+    )
+    parser.add_argument(
+        "--max-age-days", type=float, default=None,
+        help="also delete live users' coupons older than this",
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    collect(args.grace_hours, args.max_age_days, args.dry_run)
+
+
+# -------------------------------------------------
+# Entry
+# -------------------------------------------------
+if __name__ == "__main__":
+    main()
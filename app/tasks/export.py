@@ -0,0 +1,94 @@
+"""Stream the users / sent_users tables out as CSV or NDJSON.
+
+    python -m app.tasks.export users --format csv > users.csv
+    python -m app.tasks.export sent_users --format ndjson -o sent.ndjson
+    python -m app.tasks.export users --state REDEEMED
+
+The same generators back GET /admin/export/<table>, which needs an
+X-Admin-Token header matching ADMIN_TOKEN (disabled when it is unset).
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+
+from app.db import iter_pages
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("export")
+
+# Table → exported columns; the first column is the unique keyset cursor
+TABLES = {
+    "users": ("phone", "name", "state", "redeemed_at"),
+    "sent_users": ("phone",),
+}
+
+
+# -------------------------------------------------
+# Encoders (one chunk per page, not per row)
+# -------------------------------------------------
+def iter_csv(table: str, states=None, page_size: int = 1000):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    writer.writerow(TABLES[table])
+    for page in iter_pages(table, TABLES[table], states, page_size):
+        writer.writerows(page)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+    # Header only, for an empty table
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def iter_ndjson(table: str, states=None, page_size: int = 1000):
+    columns = TABLES[table]
+    for page in iter_pages(table, TABLES[table], states, page_size):
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+            for row in page
+        )
+
+
+FORMATS = {
+    "csv": ("text/csv", iter_csv),
+    "ndjson": ("application/x-ndjson", iter_ndjson),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("table", choices=sorted(TABLES))
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument(
+        "--state", action="append", dest="states",
+        help="users only: state to include (repeatable, default all)",
+    )
+    parser.add_argument("--page-size", type=int, default=5000)
+    parser.add_argument("-o", "--output", help="file to write (default stdout)")
+    args = parser.parse_args(argv)
+
+    _, encode = FORMATS[args.format]
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+
+    size = 0
+    try:
+        for chunk in encode(args.table, args.states, args.page_size):
+            out.write(chunk)
+            size += len(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    logger.info(f"✅ Exported {args.table} as {args.format} ({size} chars)")
+
+
+# -------------------------------------------------
+# Entry
+# -------------------------------------------------
+if __name__ == "__main__":
+    main()
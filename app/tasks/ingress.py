@@ -0,0 +1,187 @@
+import atexit
+import json
+import logging
+import signal
+import sys
+import time
+import zlib
+
+import redis
+
+from app.config import Config
+from app.metrics import start_exporter
+from app.tasks.queue import dead_key, get_redis
+from app.tasks.supervisor import supervise
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("webhook_ingress")
+
+STREAM = "webhook_ingress:{}"
+GROUP = "webhook"
+RETRY_DELAY = 1.0
+
+
+# -------------------------------------------------
+# Producer side (used by the /webhook view)
+# -------------------------------------------------
+def partition_for(phone) -> int:
+    return zlib.crc32(str(phone or "").encode()) % Config.INGRESS_PARTITIONS
+
+
+def split_payload(payload):
+    """Split a delivery into per-partition payloads, keeping each phone's order."""
+    parts = {}
+
+    for entry in payload.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            base = {
+                k: v for k, v in value.items() if k not in ("messages", "statuses")
+            }
+            per_change = {}
+
+            for status in value.get("statuses") or []:
+                p = partition_for(status.get("recipient_id"))
+                per_change.setdefault(p, dict(base)).setdefault("statuses", []).append(status)
+
+            for message in value.get("messages") or []:
+                p = partition_for(message.get("from"))
+                per_change.setdefault(p, dict(base)).setdefault("messages", []).append(message)
+
+            for p, part in per_change.items():
+                parts.setdefault(p, []).append({"changes": [{"value": part}]})
+
+    return {p: {"entry": entries} for p, entries in parts.items()}
+
+
+def publish(payload) -> int:
+    """XADD each partition's slice of the delivery in one round trip."""
+    parts = split_payload(payload)
+    if not parts:
+        return 0
+
+    pipe = get_redis().pipeline(transaction=False)
+    for p, part in parts.items():
+        pipe.xadd(
+            STREAM.format(p),
+            {"payload": json.dumps(part)},
+            maxlen=Config.INGRESS_MAXLEN,
+            approximate=True,
+        )
+    pipe.execute()
+    return len(parts)
+
+
+# -------------------------------------------------
+# Consumer side (one consumer per partition → per-phone order)
+# -------------------------------------------------
+def _ensure_group(r, stream):
+    try:
+        r.xgroup_create(stream, GROUP, id="0", mkstream=True)
+    except redis.ResponseError as exc:
+        if "BUSYGROUP" not in str(exc):
+            raise
+
+
+def _dead_letter(r, stream, entry_id, payload, error):
+    """Park an entry that keeps failing so it stops blocking its partition."""
+    pipe = r.pipeline(transaction=True)
+    pipe.rpush(dead_key(stream), json.dumps({"id": entry_id, "payload": payload, "error": error}))
+    pipe.xack(stream, GROUP, entry_id)
+    pipe.execute()
+
+
+def consume(partition: int):
+    # Imported here so the producer side does not pull in the handlers
+    from app.db import init_db, start_quota_writeback
+    from app.handlers.webhook import handle_event
+    from app.tasks.outbox import start_outbox_relay
+
+    init_db()
+    start_quota_writeback()
+    start_outbox_relay()
+
+    r = get_redis()
+    stream = STREAM.format(partition)
+    consumer = f"partition-{partition}"
+
+    while True:
+        try:
+            _ensure_group(r, stream)
+            break
+        except redis.RedisError:
+            logger.exception(f"🔥 Could not create consumer group on {stream}")
+            time.sleep(RETRY_DELAY)
+
+    logger.info(f"🚀 Ingress consumer started on {stream}")
+
+    # Start with our own un-acked backlog from a previous run
+    last_id = "0"
+    attempts = {}
+
+    while True:
+        try:
+            resp = r.xreadgroup(
+                GROUP, consumer, {stream: last_id}, count=50, block=5000
+            )
+        except Exception:
+            logger.exception("🔥 Ingress consumer failed reading stream")
+            time.sleep(RETRY_DELAY)
+            continue
+
+        entries = resp[0][1] if resp else []
+        if last_id == "0" and not entries:
+            last_id = ">"
+            continue
+
+        for entry_id, fields in entries:
+            try:
+                handle_event(json.loads(fields["payload"]))
+                r.xack(stream, GROUP, entry_id)
+                attempts.pop(entry_id, None)
+                continue
+            except redis.RedisError:
+                # Handled but not acked: the replay is dropped by dedup
+                logger.exception(f"🔥 Ingress event {entry_id} could not be acked")
+            except Exception as e:
+                attempts[entry_id] = attempts.get(entry_id, 0) + 1
+                logger.exception(
+                    f"🔥 Ingress event {entry_id} failed "
+                    f"(attempt {attempts[entry_id]}/{Config.INGRESS_MAX_ATTEMPTS})"
+                )
+                if attempts[entry_id] >= Config.INGRESS_MAX_ATTEMPTS:
+                    try:
+                        _dead_letter(r, stream, entry_id, fields.get("payload"), repr(e))
+                        attempts.pop(entry_id)
+                        logger.error(f"☠️ Ingress event {entry_id} dead-lettered")
+                        continue
+                    except redis.RedisError:
+                        logger.exception(f"🔥 Could not dead-letter {entry_id}")
+
+            # Leave it pending and replay from our backlog; later entries
+            # wait too, so each phone's messages stay in order
+            last_id = "0"
+            time.sleep(RETRY_DELAY)
+            break
+
+
+def run():
+    from app.db import flush_quota
+
+    # docker stop → SystemExit, so atexit runs and grants made by the
+    # (killed) partition processes still reach SQLite
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    atexit.register(flush_quota)
+
+    logger.info(f"🚀 Ingress pool starting with {Config.INGRESS_PARTITIONS} partitions")
+    supervise([
+        (f"ingress-{p}", consume, (p,)) for p in range(Config.INGRESS_PARTITIONS)
+    ])
+
+
+# -------------------------------------------------
+# Entry
+# -------------------------------------------------
+if __name__ == "__main__":
+    start_exporter(Config.METRICS_PORT)
+    run()
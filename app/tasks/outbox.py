@@ -0,0 +1,76 @@
+"""Coupon outbox: make sure every granted coupon reaches the render queue.
+
+complete_signup writes a coupon_outbox row in the same transaction that
+grants the coupon. The webhook clears it once its render task is in
+Redis; a row still there after COUPON_OUTBOX_SECONDS means that push
+failed (or the process died in between), and the relay enqueues it.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.config import Config
+from app.constants import COUPON_CAPTION
+from app.db import claim_coupon_outbox, clear_coupon_outbox, restore_coupon_outbox
+from app.tasks.queue import RENDER_QUEUE, enqueue_many
+
+logger = logging.getLogger("coupon_outbox")
+
+
+def coupon_task(to, name, caption=COUPON_CAPTION) -> dict:
+    return {
+        "type": "render_coupon",
+        "to": to,
+        "name": name,
+        "caption": caption,
+    }
+
+
+def coupon_enqueued(phone: str):
+    """Clear the outbox row; on failure the relay sends a (harmless) duplicate."""
+    try:
+        clear_coupon_outbox(phone)
+    except Exception:
+        logger.exception(f"🔥 Could not clear coupon outbox → {phone}")
+
+
+def relay_once() -> int:
+    """Enqueue renders for coupons granted too long ago to still be in flight."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=Config.COUPON_OUTBOX_SECONDS)
+    rows = claim_coupon_outbox(cutoff.isoformat())
+    if not rows:
+        return 0
+
+    try:
+        enqueue_many(
+            (coupon_task(phone, name) for phone, name, _ in rows), queue=RENDER_QUEUE
+        )
+    except Exception:
+        restore_coupon_outbox(rows)
+        raise
+
+    logger.warning(f"♻️ Relayed {len(rows)} coupon renders from the outbox")
+    return len(rows)
+
+
+_relay_pid = None
+
+
+def start_outbox_relay():
+    """Run relay_once every COUPON_OUTBOX_SECONDS on a daemon thread."""
+    global _relay_pid
+    if _relay_pid == os.getpid():
+        return
+    _relay_pid = os.getpid()
+
+    def loop():
+        while True:
+            time.sleep(Config.COUPON_OUTBOX_SECONDS)
+            try:
+                relay_once()
+            except Exception:
+                logger.exception("🔥 Coupon outbox relay failed")
+
+    threading.Thread(target=loop, name="coupon-outbox", daemon=True).start()
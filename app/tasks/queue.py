@@ -1,14 +1,198 @@
 import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
 import redis
 from app.config import Config
+from app.metrics import ENQUEUE_SECONDS, ENQUEUED_TOTAL
+
+QUEUE = "whatsapp_tasks"
+RENDER_QUEUE = "render_tasks"
+
+# Shared by every client in the process; redis-py reopens it after fork.
+_pool = redis.ConnectionPool(
+    host=Config.REDIS_HOST,
+    port=Config.REDIS_PORT,
+    decode_responses=True
+)
+
+_batch = threading.local()
+
 
 def get_redis():
-    return redis.Redis(
-        host=Config.REDIS_HOST,
-        port=Config.REDIS_PORT,
-        decode_responses=True
-    )
-
-def enqueue(task: dict):
-    r = get_redis()
-    r.rpush("whatsapp_tasks", json.dumps(task))
+    return redis.Redis(connection_pool=_pool)
+
+
+def _push(items):
+    """RPUSH (queue, task) pairs in one round trip, keeping their order."""
+    pipe = get_redis().pipeline(transaction=False)
+
+    run_queue, run = None, []
+    for queue, task in items:
+        if queue != run_queue and run:
+            pipe.rpush(run_queue, *run)
+            run = []
+        run_queue = queue
+        run.append(json.dumps(task))
+    if run:
+        pipe.rpush(run_queue, *run)
+
+    with ENQUEUE_SECONDS.time():
+        pipe.execute()
+
+    for queue, _ in items:
+        ENQUEUED_TOTAL.labels(queue=queue).inc()
+
+
+def enqueue(task: dict, queue: str = QUEUE):
+    enqueue_many([task], queue=queue)
+
+
+def enqueue_many(tasks, queue: str = QUEUE):
+    items = [(queue, task) for task in tasks]
+    if not items:
+        return
+
+    pending = getattr(_batch, "items", None)
+    if pending is not None:
+        pending.extend(items)
+        return
+
+    _push(items)
+
+
+@contextmanager
+def batch():
+    """Collect enqueue() calls on this thread and flush them together."""
+    if getattr(_batch, "items", None) is not None:
+        yield
+        return
+
+    _batch.items, _batch.callbacks = [], []
+    try:
+        yield
+    finally:
+        items, _batch.items = _batch.items, None
+        callbacks, _batch.callbacks = _batch.callbacks, None
+        if items:
+            _push(items)
+        for fn in callbacks:
+            fn()
+
+
+def after_flush(fn):
+    """Call fn once this thread's enqueued tasks are in Redis (now if unbatched)."""
+    callbacks = getattr(_batch, "callbacks", None)
+    if callbacks is None:
+        fn()
+    else:
+        callbacks.append(fn)
+
+
+# -------------------------------------------------
+# Reliable consumption (in-flight lists + dead letters)
+# -------------------------------------------------
+def processing_key(queue: str, worker_id: str) -> str:
+    return f"{queue}:processing:{worker_id}"
+
+
+def heartbeat_key(queue: str, worker_id: str) -> str:
+    return f"{queue}:heartbeat:{worker_id}"
+
+
+def workers_key(queue: str) -> str:
+    return f"{queue}:workers"
+
+
+def dead_key(queue: str) -> str:
+    return f"{queue}:dead"
+
+
+def claim(r, queue: str, worker_id: str, timeout: int = 5):
+    """Atomically move the next task into this worker's in-flight list."""
+    return r.blmove(queue, processing_key(queue, worker_id), timeout, "LEFT", "RIGHT")
+
+
+def ack(r, queue: str, worker_id: str, raw: str):
+    r.lrem(processing_key(queue, worker_id), 1, raw)
+
+
+def fail(r, queue: str, worker_id: str, raw: str, error: str = ""):
+    """Re-queue a failed task, or dead-letter it after WORKER_MAX_ATTEMPTS."""
+    try:
+        task = json.loads(raw)
+    except ValueError:
+        task = None
+
+    if isinstance(task, dict):
+        task["attempts"] = task.get("attempts", 0) + 1
+        dead = task["attempts"] >= Config.WORKER_MAX_ATTEMPTS
+    else:
+        task, dead = {"raw": raw}, True
+
+    if dead:
+        task["error"] = error
+
+    pipe = r.pipeline(transaction=True)
+    pipe.lrem(processing_key(queue, worker_id), 1, raw)
+    pipe.rpush(dead_key(queue) if dead else queue, json.dumps(task))
+    pipe.execute()
+    return dead
+
+
+def heartbeat(r, queue: str, worker_id: str):
+    pipe = r.pipeline(transaction=False)
+    pipe.sadd(workers_key(queue), worker_id)
+    pipe.set(heartbeat_key(queue, worker_id), 1, ex=Config.WORKER_HEARTBEAT_TTL)
+    pipe.execute()
+
+
+def requeue_in_flight(r, queue: str, worker_id: str) -> int:
+    """Move a worker's in-flight tasks back to the head of the queue."""
+    moved = 0
+    while r.lmove(processing_key(queue, worker_id), queue, "RIGHT", "LEFT"):
+        moved += 1
+    return moved
+
+
+def reap(r, queue: str) -> int:
+    """Recover tasks held by workers whose heartbeat has expired."""
+    moved = 0
+    for worker_id in r.smembers(workers_key(queue)):
+        if r.exists(heartbeat_key(queue, worker_id)):
+            continue
+        moved += requeue_in_flight(r, queue, worker_id)
+        r.srem(workers_key(queue), worker_id)
+    return moved
+
+
+def start_heartbeat(queue: str, worker_id: str, logger):
+    """Keep this worker alive and reap dead peers from a daemon thread."""
+    def beat():
+        r = get_redis()
+        last_reap = 0.0
+        while True:
+            try:
+                heartbeat(r, queue, worker_id)
+
+                now = time.monotonic()
+                if now - last_reap >= Config.WORKER_REAP_INTERVAL:
+                    last_reap = now
+                    moved = reap(r, queue)
+                    if moved:
+                        logger.warning(f"♻️ Re-queued {moved} stale in-flight tasks on {queue}")
+            except Exception:
+                logger.exception("🔥 Heartbeat failed")
+
+            time.sleep(Config.WORKER_HEARTBEAT_TTL / 3)
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{queue}", daemon=True)
+    thread.start()
+    return thread
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
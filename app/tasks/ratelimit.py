@@ -0,0 +1,96 @@
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from app.config import Config
+from app.tasks.queue import get_redis
+
+BUCKET_KEY = "whatsapp:rate_bucket"
+PAUSE_KEY = "whatsapp:rate_pause"
+
+# Shared token bucket. Returns 0 when a token was taken, otherwise the
+# milliseconds to wait (the provider pause window wins if one is set).
+TAKE_TOKEN_LUA = """
+local paused = redis.call('PTTL', KEYS[2])
+if paused > 0 then
+    return paused
+end
+
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+
+def acquire():
+    """Block until the shared bucket grants one provider call."""
+    if Config.WHATSAPP_RATE_LIMIT <= 0:
+        return
+
+    r = get_redis()
+    while True:
+        wait_ms = r.eval(
+            TAKE_TOKEN_LUA,
+            2,
+            BUCKET_KEY,
+            PAUSE_KEY,
+            Config.WHATSAPP_RATE_LIMIT,
+            Config.WHATSAPP_RATE_BURST,
+        )
+        if wait_ms <= 0:
+            return
+        time.sleep(wait_ms / 1000)
+
+
+def pause(seconds: float):
+    """Hold every worker process off the provider for `seconds`."""
+    ms = int(seconds * 1000)
+    if ms > 0:
+        get_redis().set(PAUSE_KEY, 1, px=ms)
+
+
+def backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    ceiling = min(
+        Config.WHATSAPP_BACKOFF_MAX,
+        Config.WHATSAPP_BACKOFF_BASE * (2 ** attempt),
+    )
+    return random.uniform(0, ceiling)
+
+
+def retry_after(response):
+    """Seconds from a Retry-After header (delta or HTTP date), else None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
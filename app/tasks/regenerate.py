@@ -0,0 +1,127 @@
+"""Bulk (re)generate coupons for users, e.g. after a template change.
+
+    python -m app.tasks.regenerate --state COMPLETED --workers 8
+    python -m app.tasks.regenerate --resume      # continue an interrupted run
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from app.coupon import generate_coupon
+from app.db import get_conn, iter_pages
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("coupon_regenerate")
+
+DEFAULT_CHECKPOINT = "regenerate.checkpoint"
+
+
+# -------------------------------------------------
+# Users to render (streamed with app.db.iter_pages)
+# -------------------------------------------------
+def count_users(states, after: str = "") -> int:
+    placeholders = ",".join("?" * len(states))
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT COUNT(*) FROM users WHERE state IN ({placeholders}) AND phone > ?",
+            [*states, after],
+        )
+        return cur.fetchone()[0]
+
+
+# -------------------------------------------------
+# Worker process
+# -------------------------------------------------
+def _render_one(phone: str, name: str):
+    logging.getLogger("whatsapp_coupon").setLevel(logging.WARNING)
+    return generate_coupon(name or "", phone)
+
+
+# -------------------------------------------------
+# Driver
+# -------------------------------------------------
+def regenerate(states, workers: int, page_size: int, checkpoint: Path, resume: bool):
+    after = ""
+    if resume and checkpoint.exists():
+        after = checkpoint.read_text().strip()
+        logger.info(f"↩️ Resuming after phone {after}")
+    elif checkpoint.exists():
+        checkpoint.unlink()
+
+    total = count_users(states, after)
+
+    logger.info(f"🚀 Regenerating {total} coupons with {workers} processes")
+
+    done = failed = 0
+    started = last_report = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for page in iter_pages("users", ("phone", "name"), states, page_size, after):
+            futures = {
+                pool.submit(_render_one, phone, name): phone for phone, name in page
+            }
+
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    failed += 1
+                    logger.exception(f"🔥 Render failed → {futures[future]}")
+                done += 1
+
+                now = time.monotonic()
+                if now - last_report >= 5:
+                    last_report = now
+                    rate = done / (now - started)
+                    eta = (total - done) / rate if rate else 0
+                    logger.info(
+                        f"📈 {done}/{total} ({failed} failed) | {rate:.1f}/s | ETA {eta:.0f}s"
+                    )
+
+            # Whole page finished: safe point to resume from
+            checkpoint.write_text(page[-1][0])
+
+    elapsed = time.monotonic() - started
+    rate = done / elapsed if elapsed else 0
+    logger.info(
+        f"✅ Done: {done} rendered, {failed} failed in {elapsed:.1f}s ({rate:.1f}/s)"
+    )
+    if not failed:
+        checkpoint.unlink(missing_ok=True)
+
+    return {"rendered": done, "failed": failed, "seconds": elapsed, "per_second": rate}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--state", action="append", dest="states",
+        help="user state to include (repeatable, default COMPLETED)",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--checkpoint", type=Path, default=Path(DEFAULT_CHECKPOINT))
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="skip users up to the phone stored in the checkpoint file",
+    )
+    args = parser.parse_args(argv)
+
+    regenerate(
+        states=args.states or ["COMPLETED"],
+        workers=args.workers,
+        page_size=args.page_size,
+        checkpoint=args.checkpoint,
+        resume=args.resume,
+    )
+
+
+# -------------------------------------------------
+# Entry
+# -------------------------------------------------
+if __name__ == "__main__":
+    main()
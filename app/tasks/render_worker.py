@@ -0,0 +1,129 @@
+import json
+import logging
+
+from app.config import Config
+from app.coupon import generate_coupon, render_coupon_bytes
+from app.metrics import start_exporter
+from app.qr_token import require_signing_key
+from app.tasks.queue import (
+    RENDER_QUEUE,
+    ack,
+    claim,
+    enqueue,
+    fail,
+    get_redis,
+    requeue_in_flight,
+    start_heartbeat,
+    worker_id,
+)
+from app.tasks.supervisor import supervise
+from app.tasks.worker import make_session, upload_media
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("render_worker")
+
+
+# -------------------------------------------------
+# Task handling
+# -------------------------------------------------
+_session = None
+
+
+def _provider_session():
+    global _session
+    if _session is None:
+        _session = make_session(1)
+    return _session
+
+
+def render_coupon(task):
+    """Render the coupon image and chain the send_image task."""
+    to = task["to"]
+    send = {
+        "type": "send_image",
+        "to": to,
+        "caption": task.get("caption", ""),
+    }
+
+    if Config.COUPON_DELIVERY == "upload":
+        # Bytes go straight from memory to the provider: no disk write and
+        # no inbound fetch of our static URL
+        data, filename, mime = render_coupon_bytes(task.get("name", ""), to)
+        send["media_id"] = upload_media(_provider_session(), data, filename, mime)
+        logger.info(f"📤 Queue image → {to} | media {send['media_id']}")
+    else:
+        send["image_url"] = generate_coupon(task.get("name", ""), to)
+        logger.info(f"📤 Queue image → {to} | {send['image_url']}")
+
+    enqueue(send)
+
+
+# -------------------------------------------------
+# Worker loop
+# -------------------------------------------------
+def run():
+    r = get_redis()
+    wid = worker_id()
+
+    recovered = requeue_in_flight(r, RENDER_QUEUE, wid)
+    if recovered:
+        logger.warning(f"♻️ Re-queued {recovered} render tasks from a previous run")
+    start_heartbeat(RENDER_QUEUE, wid, logger)
+
+    logger.info(f"🎨 Render worker {wid} started and waiting for tasks...")
+
+    while True:
+        try:
+            raw = claim(r, RENDER_QUEUE, wid)
+        except Exception:
+            logger.exception("🔥 Render worker crashed while reading queue")
+            continue
+
+        if raw is None:
+            continue
+
+        try:
+            task = json.loads(raw)
+
+            task_type = task.get("type")
+            to = task.get("to")
+
+            if task_type != "render_coupon" or not to:
+                logger.warning(f"⚠️ Invalid render task skipped: {task}")
+            else:
+                logger.info(f"➡️ Rendering coupon → {to}")
+                render_coupon(task)
+
+        except Exception as exc:
+            logger.exception("🔥 Render worker crashed while processing task")
+            try:
+                if fail(r, RENDER_QUEUE, wid, raw, error=repr(exc)):
+                    logger.error(f"☠️ Render task dead-lettered: {raw}")
+            except Exception:
+                # Still in our in-flight list: retried on restart or by the reaper
+                logger.exception("🔥 Render worker could not record failure")
+            continue
+
+        try:
+            ack(r, RENDER_QUEUE, wid, raw)
+        except Exception:
+            logger.exception("🔥 Render worker could not ack task")
+
+
+def run_pool(size: int):
+    """Run `size` render processes; PIL work is CPU bound, so no threads."""
+    if size <= 1:
+        run()
+        return
+
+    logger.info(f"🚀 Render pool starting with {size} processes")
+    supervise([(f"render-{i}", run, ()) for i in range(size)])
+
+
+# -------------------------------------------------
+# Entry
+# -------------------------------------------------
+if __name__ == "__main__":
+    require_signing_key()
+    start_exporter(Config.METRICS_PORT)
+    run_pool(Config.RENDER_WORKERS)
@@ -0,0 +1,32 @@
+import logging
+import multiprocessing
+import time
+
+logger = logging.getLogger("supervisor")
+
+
+def supervise(children, poll: float = 1.0):
+    """
+    Run one process per (name, target, args) and restart any that exits.
+
+    A pool whose children die one by one would otherwise keep "running"
+    with nothing consuming. Restarts are paced by `poll`, so a child
+    that crashes on start (e.g. Redis down) retries once per interval
+    instead of spinning.
+    """
+    def start(name, target, args):
+        proc = multiprocessing.Process(target=target, args=args, name=name, daemon=True)
+        proc.start()
+        return proc
+
+    procs = {name: start(name, target, args) for name, target, args in children}
+    specs = {name: (target, args) for name, target, args in children}
+
+    while True:
+        time.sleep(poll)
+        for name, proc in procs.items():
+            if proc.is_alive():
+                continue
+
+            logger.error(f"💀 {name} exited (code {proc.exitcode}); restarting")
+            procs[name] = start(name, *specs[name])
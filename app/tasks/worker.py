@@ -1,11 +1,25 @@
 import json
-import redis
-import requests
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from app.config import Config
+import requests
+from requests.adapters import HTTPAdapter
 
-QUEUE = "whatsapp_tasks"
+from app.config import Config
+from app.metrics import PROVIDER_SECONDS, start_exporter
+from app.tasks import ratelimit
+from app.tasks.queue import (
+    QUEUE,
+    ack,
+    claim,
+    fail,
+    get_redis,
+    requeue_in_flight,
+    start_heartbeat,
+    worker_id,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("whatsapp_worker")
@@ -21,89 +35,222 @@ def headers():
     }
 
 
+def make_session(pool_size: int):
+    """Session whose connection pool can serve `pool_size` concurrent posts."""
+    session = requests.Session()
+    session.headers.update(headers())
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 # -------------------------------------------------
-# Worker loop
+# Provider calls (rate limited, retried)
 # -------------------------------------------------
-def run():
-    r = redis.Redis(
-        host=Config.REDIS_HOST,
-        port=Config.REDIS_PORT,
-        decode_responses=True,
-    )
+class SendError(Exception):
+    pass
+
+
+def _retryable(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
 
-    session = requests.Session()
-    session.headers.update(headers())
 
-    logger.info("🚀 WhatsApp worker started and waiting for tasks...")
+def post_provider(session, url, **kwargs):
+    """POST to the provider, retrying 429/5xx/network errors with backoff."""
+    max_retries = Config.WHATSAPP_MAX_RETRIES
+    endpoint = url.rstrip("/").rsplit("/", 1)[-1]
 
-    while True:
+    for attempt in range(max_retries + 1):
+        ratelimit.acquire()
+
+        started = time.perf_counter()
         try:
-            _, raw = r.blpop(QUEUE)
-            task = json.loads(raw)
+            response = session.post(url, timeout=10, **kwargs)
+        except requests.RequestException as exc:
+            reason = type(exc).__name__
+            delay = ratelimit.backoff(attempt)
+            PROVIDER_SECONDS.labels(endpoint=endpoint, status=reason).observe(
+                time.perf_counter() - started
+            )
+        else:
+            PROVIDER_SECONDS.labels(
+                endpoint=endpoint, status=str(response.status_code)
+            ).observe(time.perf_counter() - started)
 
-            task_type = task.get("type")
-            to = task.get("to")
+            if not _retryable(response.status_code):
+                return response
 
-            if not task_type or not to:
-                logger.warning(f"⚠️ Invalid task skipped: {task}")
-                continue
+            reason = response.status_code
+            delay = ratelimit.retry_after(response)
+            if delay is None:
+                delay = ratelimit.backoff(attempt)
+            if response.status_code == 429:
+                # Throttled: slow every worker down, not just this thread
+                ratelimit.pause(delay)
+
+        if attempt == max_retries:
+            break
+
+        logger.warning(
+            f"⏳ Provider returned {reason}; retry {attempt + 1}/{max_retries} in {delay:.2f}s"
+        )
+        time.sleep(delay)
+
+    raise SendError(f"Provider call failed after {max_retries + 1} attempts ({reason})")
+
+
+def post_message(session, payload):
+    return post_provider(session, Config.WHATSAPP_API_URL, json=payload)
 
-            logger.info(f"➡️ Processing task: {task_type} → {to}")
-
-            # -------------------------
-            # SEND TEXT
-            # -------------------------
-            if task_type == "send_text":
-                response = session.post(
-                    Config.WHATSAPP_API_URL,
-                    json={
-                        "messaging_product": "whatsapp",
-                        "to": to,
-                        "type": "text",
-                        "text": {
-                            "body": task["text"]
-                        },
-                    },
-                    timeout=10,
-                )
-
-                logger.info(f"✅ Text sent → {response.status_code}")
-
-            # -------------------------
-            # SEND IMAGE (PUBLIC URL)
-            # -------------------------
-            elif task_type == "send_image":
-                image_url = task.get("image_url")
-
-                if not image_url:
-                    logger.warning("⚠️ send_image task missing image_url")
-                    continue
-
-                response = session.post(
-                    Config.WHATSAPP_API_URL,
-                    json={
-                        "messaging_product": "whatsapp",
-                        "to": to,
-                        "type": "image",
-                        "image": {
-                            "link": image_url,
-                            "caption": task.get("caption", ""),
-                        },
-                    },
-                    timeout=10,
-                )
-
-                logger.info(f"🖼️ Image sent → {response.status_code}")
-
-            else:
-                logger.warning(f"⚠️ Unknown task type: {task_type}")
 
+def upload_media(session, data: bytes, filename: str, mime: str) -> str:
+    """Upload in-memory media to the provider and return its media id."""
+    response = post_provider(
+        session,
+        Config.WHATSAPP_MEDIA_URL,
+        data={"messaging_product": "whatsapp", "type": mime},
+        files={"file": (filename, data, mime)},
+        # Drop the session's JSON content type so requests sets the multipart one
+        headers={"Content-Type": None},
+    )
+
+    if not response.ok:
+        raise SendError(f"Media upload rejected ({response.status_code})")
+
+    return response.json()["id"]
+
+
+# -------------------------------------------------
+# Task handling
+# -------------------------------------------------
+def process_task(session, task):
+    task_type = task.get("type")
+    to = task.get("to")
+
+    if not task_type or not to:
+        logger.warning(f"⚠️ Invalid task skipped: {task}")
+        return
+
+    logger.info(f"➡️ Processing task: {task_type} → {to}")
+
+    # -------------------------
+    # SEND TEXT
+    # -------------------------
+    if task_type == "send_text":
+        response = post_message(
+            session,
+            {
+                "messaging_product": "whatsapp",
+                "to": to,
+                "type": "text",
+                "text": {
+                    "body": task["text"]
+                },
+            },
+        )
+
+        logger.info(f"✅ Text sent → {response.status_code}")
+
+    # -------------------------
+    # SEND IMAGE (UPLOADED MEDIA ID OR PUBLIC URL)
+    # -------------------------
+    elif task_type == "send_image":
+        media_id = task.get("media_id")
+        image_url = task.get("image_url")
+
+        if media_id:
+            image = {"id": media_id}
+        elif image_url:
+            image = {"link": image_url}
+        else:
+            logger.warning("⚠️ send_image task missing image_url/media_id")
+            return
+
+        image["caption"] = task.get("caption", "")
+
+        response = post_message(
+            session,
+            {
+                "messaging_product": "whatsapp",
+                "to": to,
+                "type": "image",
+                "image": image,
+            },
+        )
+
+        logger.info(f"🖼️ Image sent → {response.status_code}")
+
+    else:
+        logger.warning(f"⚠️ Unknown task type: {task_type}")
+
+
+def _process_raw(session, r, wid, raw):
+    try:
+        process_task(session, json.loads(raw))
+    except Exception as exc:
+        logger.exception("🔥 Worker crashed while processing task")
+        try:
+            if fail(r, QUEUE, wid, raw, error=repr(exc)):
+                logger.error(f"☠️ Task dead-lettered: {raw}")
         except Exception:
-            logger.exception("🔥 Worker crashed while processing task")
+            # Still in our in-flight list: retried on restart or by the reaper
+            logger.exception("🔥 Worker could not record failure")
+        return
+
+    try:
+        ack(r, QUEUE, wid, raw)
+    except Exception:
+        logger.exception("🔥 Worker could not ack task")
+
+
+# -------------------------------------------------
+# Worker loop
+# -------------------------------------------------
+def run(concurrency: int = Config.WORKER_CONCURRENCY):
+    """Consume the queue with at most `concurrency` sends in flight.
+
+    Each task is moved into this worker's in-flight list and only removed
+    once sent, so tasks held by a crashed worker are re-queued by a peer.
+    """
+    r = get_redis()
+    wid = worker_id()
+    session = make_session(concurrency)
+
+    recovered = requeue_in_flight(r, QUEUE, wid)
+    if recovered:
+        logger.warning(f"♻️ Re-queued {recovered} tasks from a previous run")
+    start_heartbeat(QUEUE, wid, logger)
+
+    logger.info(
+        f"🚀 WhatsApp worker {wid} started (concurrency={concurrency}) and waiting for tasks..."
+    )
+
+    # A slot is taken before claiming, so tasks are only pulled off the
+    # queue when a thread is free to send them.
+    slots = threading.BoundedSemaphore(concurrency)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            slots.acquire()
+            try:
+                raw = claim(r, QUEUE, wid)
+            except Exception:
+                raw = None
+                logger.exception("🔥 Worker crashed while reading queue")
+
+            if raw is None:
+                slots.release()
+                continue
+
+            future = pool.submit(_process_raw, session, r, wid, raw)
+            future.add_done_callback(lambda _: slots.release())
 
 
 # -------------------------------------------------
 # Entry
 # -------------------------------------------------
 if __name__ == "__main__":
+    start_exporter(Config.METRICS_PORT)
     run()
@@ -5,9 +5,14 @@ class ApiService {
   // Emulator → host machine
   static const String baseUrl = "https://allspray.in";
 
-  static Future<Map<String, dynamic>> getStatus(String phone) async {
+  // Scans per redeemBatch call; must not exceed the server's QR_BATCH_MAX
+  static const int maxBatch = 500;
+
+  // `code` is the raw scanned QR value (signed token or legacy phone);
+  // the server verifies it, so forged codes never reach the database.
+  static Future<Map<String, dynamic>> getStatus(String code) async {
     final response = await http.get(
-      Uri.parse("$baseUrl/api/qr/status/$phone"),
+      Uri.parse("$baseUrl/api/qr/status/${Uri.encodeComponent(code)}"),
     );
 
     if (response.statusCode == 200) {
@@ -20,9 +25,23 @@ class ApiService {
     }
   }
 
-  static Future<Map<String, dynamic>> redeem(String phone) async {
+  static Future<Map<String, dynamic>> redeem(String code) async {
+    final response = await http.post(
+      Uri.parse("$baseUrl/api/qr/redeem/${Uri.encodeComponent(code)}"),
+    );
+
+    return jsonDecode(response.body);
+  }
+
+  // Sync scans queued while offline in one request. Each scan is
+  // {"id": ..., "code": ..., "scanned_at": ISO-8601}; results echo `id`.
+  static Future<Map<String, dynamic>> redeemBatch(
+    List<Map<String, dynamic>> scans,
+  ) async {
     final response = await http.post(
-      Uri.parse("$baseUrl/api/qr/redeem/$phone"),
+      Uri.parse("$baseUrl/api/qr/redeem-batch"),
+      headers: {"Content-Type": "application/json"},
+      body: jsonEncode({"scans": scans}),
     );
 
     return jsonDecode(response.body);
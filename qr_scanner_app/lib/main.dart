@@ -31,50 +31,92 @@ class _QRScannerPageState extends State<QRScannerPage> {
   bool scanned = false;
   bool loading = false;
 
-  String? phone;
   Map<String, dynamic>? userData;
 
+  // Scans made while the shop Wi-Fi is down, synced in batches later.
+  // Kept in memory: sync before closing the app.
+  final List<Map<String, dynamic>> pending = [];
+  int nextScanId = 0;
+
+  // Signed coupons are verified server-side, so a scan redeems directly:
+  // one request per customer instead of status + redeem.
   Future<void> handleScan(String value) async {
     if (scanned) return;
 
     scanned = true;
     controller.stop();
 
-    setState(() {
-      loading = true;
-      phone = value;
-    });
-
-    final data = await ApiService.getStatus(value);
-
-    setState(() {
-      userData = data;
-      loading = false;
-    });
-  }
-
-  Future<void> redeem() async {
-    if (phone == null) return;
-
     setState(() => loading = true);
 
-    final result = await ApiService.redeem(phone!);
-    final updated = await ApiService.getStatus(phone!);
+    Map<String, dynamic> result;
+    try {
+      result = await ApiService.redeem(value);
+    } catch (_) {
+      pending.add({
+        "id": nextScanId++,
+        "code": value,
+        "scanned_at": DateTime.now().toUtc().toIso8601String(),
+      });
+      result = {"status": "queued_offline"};
+    }
 
     setState(() {
-      userData = updated;
+      userData = result;
       loading = false;
     });
 
     ScaffoldMessenger.of(context).showSnackBar(
-      SnackBar(content: Text(result["status"])),
+      SnackBar(content: Text(result["status"] ?? "error")),
     );
   }
 
+  Future<void> syncPending() async {
+    if (pending.isEmpty) return;
+
+    final queue = List<Map<String, dynamic>>.from(pending);
+    var syncedCount = 0;
+    var redeemed = 0;
+
+    // Chunked to the server's batch limit; each chunk is dropped from the
+    // queue once acknowledged, so a failure mid-way only retries the rest.
+    try {
+      for (var i = 0; i < queue.length; i += ApiService.maxBatch) {
+        final end = i + ApiService.maxBatch < queue.length
+            ? i + ApiService.maxBatch
+            : queue.length;
+        final response = await ApiService.redeemBatch(queue.sublist(i, end));
+        final synced = {
+          for (final r in response["results"] as List) r["id"],
+        };
+
+        setState(() {
+          pending.removeWhere((scan) => synced.contains(scan["id"]));
+        });
+        syncedCount += synced.length;
+        redeemed += response["redeemed"] as int;
+      }
+
+      ScaffoldMessenger.of(context).showSnackBar(
+        SnackBar(
+          content: Text("Synced $syncedCount scans, $redeemed redeemed"),
+        ),
+      );
+    } catch (_) {
+      ScaffoldMessenger.of(context).showSnackBar(
+        SnackBar(
+          content: Text(
+            syncedCount == 0
+                ? "Still offline, try again later"
+                : "Synced $syncedCount scans; ${pending.length} left, try again later",
+          ),
+        ),
+      );
+    }
+  }
+
   void resetScanner() {
     setState(() {
       scanned = false;
-      phone = null;
       userData = null;
     });
     controller.start();
@@ -86,6 +128,12 @@ class _QRScannerPageState extends State<QRScannerPage> {
       appBar: AppBar(
         title: const Text("QR Scanner"),
         actions: [
+          if (pending.isNotEmpty)
+            TextButton.icon(
+              icon: const Icon(Icons.sync),
+              label: Text("${pending.length}"),
+              onPressed: syncPending,
+            ),
           IconButton(
             icon: const Icon(Icons.refresh),
             onPressed: resetScanner,
@@ -113,10 +161,7 @@ class _QRScannerPageState extends State<QRScannerPage> {
                   ? const CircularProgressIndicator()
                   : userData == null
                       ? const Text("Scan a QR code")
-                      : UserStatusCard(
-                          data: userData!,
-                          onRedeem: redeem,
-                        ),
+                      : UserStatusCard(data: userData!),
             ),
           ),
         ],
@@ -131,27 +176,25 @@ class _QRScannerPageState extends State<QRScannerPage> {
 
 class UserStatusCard extends StatelessWidget {
   final Map<String, dynamic> data;
-  final VoidCallback onRedeem;
 
   const UserStatusCard({
     super.key,
     required this.data,
-    required this.onRedeem,
   });
 
-  String formatTimestamp(String isoString) {
-    final dateTime = DateTime.parse(isoString).toLocal();
-    return "${dateTime.day.toString().padLeft(2, '0')}-"
-        "${dateTime.month.toString().padLeft(2, '0')}-"
-        "${dateTime.year}  "
-        "${dateTime.hour.toString().padLeft(2, '0')}:"
-        "${dateTime.minute.toString().padLeft(2, '0')}";
-  }
+  static const Map<String, String> messages = {
+    "redeemed": "Offer redeemed",
+    "already_redeemed": "Already redeemed",
+    "not_eligible": "Signup not completed",
+    "not_found": "Customer not found",
+    "invalid_code": "Invalid or forged QR",
+    "queued_offline": "Offline: saved, sync later",
+  };
 
   @override
   Widget build(BuildContext context) {
-    final canRedeem = data["can_redeem"] == true;
-    final redeemedAt = data["redeemed_at"];
+    final status = data["status"] ?? "error";
+    final ok = status == "redeemed";
 
     return Card(
       margin: const EdgeInsets.all(16),
@@ -161,24 +204,13 @@ class UserStatusCard extends StatelessWidget {
           mainAxisAlignment: MainAxisAlignment.center,
           children: [
             Text("Phone: ${data["phone"] ?? "-"}"),
-            Text("Name: ${data["name"] ?? "-"}"),
-            Text("State: ${data["state"] ?? "-"}"),
-
-            if (redeemedAt != null) ...[
-              const SizedBox(height: 8),
-              Text(
-                "Redeemed at: ${formatTimestamp(redeemedAt)}",
-                style: const TextStyle(
-                  fontWeight: FontWeight.w600,
-                  color: Colors.green,
-                ),
+            const SizedBox(height: 8),
+            Text(
+              messages[status] ?? status,
+              style: TextStyle(
+                fontWeight: FontWeight.w600,
+                color: ok ? Colors.green : Colors.red,
               ),
-            ],
-
-            const SizedBox(height: 16),
-            ElevatedButton(
-              onPressed: canRedeem ? onRedeem : null,
-              child: const Text("Offer Redeem"),
             ),
           ],
         ),
@@ -0,0 +1,233 @@
+"""Benchmark the webhook → queue → render → send pipeline end to end.
+
+    python scripts/bench_pipeline.py --users 300
+    python scripts/bench_pipeline.py --json bench.json
+    python scripts/bench_pipeline.py --baseline bench.json --max-regression 0.2
+
+Synthetic users walk the whole flow: the START keyword, then their name
+(signup plus coupon render), then the keyword again once COMPLETED. Each
+webhook goes through the Flask test client. The render and send queues are
+then drained with the real worker code against scripts/stub_provider.py.
+
+Redis is fakeredis unless --redis-url is given. That database is FLUSHED,
+so point it at a scratch instance. SQLite lives in a temporary directory.
+The template image (static/images/base_coupon.png) must be present.
+
+With --baseline, the run fails (exit 1) if any stage's p95 is more than
+--max-regression slower than the baseline's.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from stub_provider import StubProvider  # noqa: E402
+
+
+# -------------------------------------------------
+# Stats
+# -------------------------------------------------
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.wall = 0.0
+
+    def time(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        self.samples.append(elapsed * 1000)
+        self.wall += elapsed
+        return result
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"count": 0}
+
+        # quantiles() needs two points; a single sample is every percentile
+        cuts = statistics.quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+        return {
+            "count": len(samples),
+            "per_second": round(len(samples) / self.wall, 1) if self.wall else 0.0,
+            "p50_ms": round(cuts[49], 3),
+            "p95_ms": round(cuts[94], 3),
+            "p99_ms": round(cuts[98], 3),
+            "max_ms": round(samples[-1], 3),
+        }
+
+
+def print_report(report):
+    print(f"{'stage':<20}{'count':>7}{'per_s':>10}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}")
+    for name, s in report.items():
+        if not s["count"]:
+            continue
+        print(
+            f"{name:<20}{s['count']:>7}{s['per_second']:>10.1f}"
+            f"{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}"
+        )
+
+
+def regressions(report, baseline, max_regression):
+    failed = []
+    for name, old in baseline.items():
+        new = report.get(name)
+        if not new or not new.get("count") or not old.get("count"):
+            continue
+        if new["p95_ms"] > old["p95_ms"] * (1 + max_regression):
+            failed.append(f"{name}: p95 {old['p95_ms']:.2f} → {new['p95_ms']:.2f} ms")
+    return failed
+
+
+# -------------------------------------------------
+# Environment
+# -------------------------------------------------
+def configure(args, provider, workdir):
+    """Point the app at the stub provider and a throwaway DB before import."""
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["WHATSAPP_API_URL"] = f"{provider.base_url}/messages"
+    os.environ["WHATSAPP_MEDIA_URL"] = f"{provider.base_url}/media"
+    os.environ["COUPON_DELIVERY"] = args.delivery
+    # Measure our code, not the provider throttle
+    os.environ.setdefault("WHATSAPP_RATE_LIMIT", "0")
+    # Coupons must be signed; a real QR_SIGNING_KEY still wins
+    os.environ.setdefault("QR_DEV_KEY", "1")
+
+    import redis
+    from app.tasks import queue
+
+    if args.redis_url:
+        queue._pool = redis.ConnectionPool.from_url(args.redis_url, decode_responses=True)
+    else:
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit("fakeredis is not installed: pip install fakeredis lupa, or pass --redis-url")
+        queue._pool = redis.ConnectionPool(
+            connection_class=fakeredis.FakeConnection,
+            server=fakeredis.FakeServer(),
+            decode_responses=True,
+        )
+
+    queue.get_redis().flushdb()
+
+
+def text_payload(phone, body, message_id):
+    return {
+        "entry": [{
+            "changes": [{
+                "value": {
+                    "messages": [{
+                        "id": message_id,
+                        "from": phone,
+                        "type": "text",
+                        "text": {"body": body},
+                    }],
+                },
+            }],
+        }],
+    }
+
+
+# -------------------------------------------------
+# Run
+# -------------------------------------------------
+def run(args):
+    from app.db import update_max_quota
+    from app.main import app
+    from app.tasks import render_worker
+    from app.tasks.queue import QUEUE, RENDER_QUEUE, ack, claim, get_redis
+    from app.tasks.worker import _process_raw, make_session
+
+    update_max_quota(args.users)
+
+    client = app.test_client()
+    r = get_redis()
+    phones = [f"91{9000000000 + i}" for i in range(args.users)]
+    stages = {
+        name: Stage(name)
+        for name in (
+            "webhook.start", "webhook.name", "webhook.completed",
+            "render", "send",
+        )
+    }
+
+    flows = (
+        ("webhook.start", lambda p: "khalifa melur"),
+        ("webhook.name", lambda p: f"User {p[-4:]}"),
+        ("webhook.completed", lambda p: "khalifa melur"),
+    )
+    for stage, body in flows:
+        for phone in phones:
+            payload = text_payload(phone, body(phone), f"wamid.{stage}.{phone}")
+            response = stages[stage].time(client.post, "/webhook", json=payload)
+            if response.status_code != 200:
+                sys.exit(f"{stage} returned {response.status_code}")
+
+    wid = "bench"
+
+    def render_one(raw):
+        render_worker.render_coupon(json.loads(raw))
+        ack(r, RENDER_QUEUE, wid, raw)
+
+    while (raw := claim(r, RENDER_QUEUE, wid, timeout=1)) is not None:
+        stages["render"].time(render_one, raw)
+
+    session = make_session(1)
+    while (raw := claim(r, QUEUE, wid, timeout=1)) is not None:
+        stages["send"].time(_process_raw, session, r, wid, raw)
+
+    return {name: stage.summary() for name, stage in stages.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--redis-url", help="scratch Redis to use instead of fakeredis")
+    parser.add_argument(
+        "--delivery", choices=("upload", "link"), default="upload",
+        help="coupon delivery; link writes files under static/images/generated",
+    )
+    parser.add_argument("--provider-latency-ms", type=float, default=0.0)
+    parser.add_argument("--json", dest="json_path", help="write the report here")
+    parser.add_argument("--baseline", help="report from an earlier --json run")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+
+    provider = StubProvider(latency_ms=args.provider_latency_ms).start()
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(args, provider, workdir)
+        started = time.perf_counter()
+        report = run(args)
+        elapsed = time.perf_counter() - started
+
+    print_report(report)
+    print(
+        f"\n{args.users} users, {len(provider.messages)} provider messages, "
+        f"{len(provider.media)} uploads in {elapsed:.1f}s"
+    )
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failed = regressions(report, json.load(f), args.max_regression)
+        for line in failed:
+            print(f"REGRESSION {line}")
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Microbenchmark: original QR stage vs the cached nearest-neighbour mask.
+
+    python scripts/bench_qr.py --iterations 500
+
+Payloads are signed coupon tokens (sign_qr), as in production. Each
+iteration signs a fresh phone number so the per-payload cache never hits;
+the "cached" row shows the re-render case (same token again).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# sign_qr needs a key; a real QR_SIGNING_KEY still wins
+os.environ.setdefault("QR_DEV_KEY", "1")
+
+import qrcode  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from app.coupon import QR_SIZE, render_qr_patch  # noqa: E402
+from app.qr_token import sign_qr  # noqa: E402
+
+
+def legacy_qr_patch(qr_data: str):
+    """The QR stage as it was: best-fit search, RGB render, LANCZOS resize."""
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_Q,
+        box_size=10,
+        border=2,
+    )
+    qr.add_data(qr_data)
+    qr.make(fit=True)
+
+    qr_img = qr.make_image(
+        fill_color="black",
+        back_color="white"
+    ).convert("RGB")
+
+    return qr_img.resize((QR_SIZE, QR_SIZE), Image.LANCZOS)
+
+
+def fast_qr_patch(qr_data: str):
+    """New stage composed onto a white square, as render_coupon does."""
+    mask, offset = render_qr_patch(qr_data)
+    img = Image.new("RGB", (QR_SIZE, QR_SIZE), "white")
+    img.paste("black", (offset, offset), mask)
+    return img
+
+
+def modules_match(legacy, fast, count: int) -> bool:
+    """Sample every module centre of both renders; both must agree dark/light.
+
+    The renders scale differently (LANCZOS to QR_SIZE vs an integer box
+    centred in it), so each is sampled on its own grid.
+    """
+    legacy, fast = legacy.convert("L"), fast.convert("L")
+    size = count + 4  # 2-module quiet zone on each side
+    step = QR_SIZE / size
+    box = QR_SIZE // size
+    offset = (QR_SIZE - size * box) // 2
+    for i in range(count):
+        for j in range(count):
+            a = legacy.getpixel((int((j + 2.5) * step), int((i + 2.5) * step)))
+            b = fast.getpixel((offset + int((j + 2.5) * box), offset + int((i + 2.5) * box)))
+            if (a < 128) != (b < 128):
+                return False
+    return True
+
+
+def bench(fn, payloads):
+    started = time.perf_counter()
+    for payload in payloads:
+        fn(payload)
+    return (time.perf_counter() - started) / len(payloads) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args(argv)
+
+    payloads = [sign_qr(f"91{9000000000 + i}") for i in range(args.iterations)]
+
+    # Warm up the version cache and imports outside the timed loops
+    warmup = sign_qr("910000000000")
+    legacy_qr_patch(warmup)
+    fast_qr_patch(warmup)
+
+    legacy_ms = bench(legacy_qr_patch, payloads)
+    render_qr_patch.cache_clear()
+    fast_ms = bench(fast_qr_patch, payloads)
+    cached_ms = bench(fast_qr_patch, payloads[:1] * len(payloads))
+
+    print(f"legacy  {legacy_ms:8.3f} ms/QR")
+    print(f"fast    {fast_ms:8.3f} ms/QR  ({legacy_ms / fast_ms:.1f}x)")
+    print(f"cached  {cached_ms:8.3f} ms/QR  ({legacy_ms / cached_ms:.1f}x)")
+
+    sample = payloads[0]
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_Q)
+    qr.add_data(sample)
+    qr.make(fit=True)
+    same = modules_match(
+        legacy_qr_patch(sample), fast_qr_patch(sample), qr.modules_count
+    )
+    print(f"module pattern matches legacy: {same}")
+
+
+if __name__ == "__main__":
+    main()
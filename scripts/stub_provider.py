@@ -0,0 +1,118 @@
+"""Local stand-in for the Pinbot/WhatsApp API (messages + media upload).
+
+    python scripts/stub_provider.py --port 9000 --latency-ms 80
+
+Then point the app at it:
+
+    WHATSAPP_API_URL=http://localhost:9000/messages
+    WHATSAPP_MEDIA_URL=http://localhost:9000/media
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubProvider(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency_ms=0.0, fail_rate=0.0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.messages = []
+        self.media = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def next_id(self, prefix):
+        with self._lock:
+            return f"{prefix}.{next(self._ids)}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        if server.latency_ms:
+            time.sleep(server.latency_ms / 1000)
+
+        if server.fail_rate and random.random() < server.fail_rate:
+            self._reply(429, {"error": "rate limited"}, {"Retry-After": "1"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        path = self.path.rstrip("/")
+        if path.endswith("/messages"):
+            server.messages.append(json.loads(body or b"{}"))
+            self._reply(200, {"messages": [{"id": server.next_id("wamid")}]})
+
+        elif path.endswith("/media"):
+            data = _multipart_file(self.headers.get("Content-Type", ""), body)
+            if data is None:
+                self._reply(400, {"error": "file is required"})
+                return
+
+            media_id = server.next_id("media")
+            server.media[media_id] = data
+            self._reply(200, {"id": media_id})
+
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def _reply(self, status, body, headers=None):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+
+def _multipart_file(content_type, body):
+    """Bytes of the `file` field of a multipart/form-data body, if any."""
+    if not content_type.startswith("multipart/form-data"):
+        return None
+
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    for part in message.iter_parts():
+        if part.get_param("name", header="content-disposition") == "file":
+            return part.get_payload(decode=True)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubProvider(args.port, args.latency_ms, args.fail_rate)
+    print(f"Stub provider listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
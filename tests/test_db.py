@@ -0,0 +1,193 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from app import db
+from app.config import Config
+
+try:
+    import fakeredis
+except ImportError:  # Redis-backend tests are skipped
+    fakeredis = None
+
+
+def _close_conn():
+    conn = getattr(db._local, "conn", None)
+    if conn is not None:
+        conn.close()
+        db._local.conn = None
+
+
+class DBTestCase(unittest.TestCase):
+    """A fresh SQLite file per test, no user cache and the SQLite quota."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        patches = (
+            mock.patch.object(db, "DB_PATH", Path(tmp.name) / "test.db"),
+            mock.patch.multiple(Config, USER_CACHE_BACKEND="off", QUOTA_BACKEND="sqlite"),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        # Connections are per thread; drop the one opened for another file
+        self.addCleanup(_close_conn)
+        _close_conn()
+        db.init_db()
+
+    def signup_concurrently(self, count):
+        """complete_signup for `count` new phones, one thread each."""
+        results = []
+
+        def signup(phone):
+            try:
+                results.append(db.complete_signup(phone, "A"))
+            finally:
+                _close_conn()
+
+        threads = [threading.Thread(target=signup, args=(str(900 + i),)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def set_quota(self, max_images, sent_images=0):
+        with db.get_conn() as conn:
+            conn.execute(
+                "UPDATE quota SET max_images = ?, sent_images = ? WHERE id = 1",
+                (max_images, sent_images),
+            )
+
+
+class IterPagesTest(DBTestCase):
+    def test_pages_cover_every_row_once(self):
+        for i in range(7):
+            db.upsert_user(str(900 + i), state="COMPLETED" if i % 2 else "ASKED_NAME")
+
+        pages = list(db.iter_pages("users", ("phone", "state"), page_size=3))
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([row[0] for page in pages for row in page], [str(900 + i) for i in range(7)])
+
+        completed = [row for page in db.iter_pages("users", ("phone",), ["COMPLETED"], 2) for row in page]
+        self.assertEqual(completed, [("901",), ("903",), ("905",)])
+
+        resumed = [row for page in db.iter_pages("users", ("phone",), after="904") for row in page]
+        self.assertEqual(resumed, [("905",), ("906",)])
+
+
+class RedeemUsersTest(DBTestCase):
+    def test_duplicate_in_batch_redeems_once(self):
+        db.upsert_user("911", state="COMPLETED", name="A")
+
+        results = db.redeem_users([
+            ("911", "2026-01-01T10:00:00+00:00"),
+            ("911", "2026-01-01T10:05:00+00:00"),
+        ])
+
+        self.assertEqual(results, ["REDEEMED", "ALREADY_REDEEMED"])
+        # The first scan's time is the one recorded
+        self.assertEqual(db.get_user("911"), ("A", "REDEEMED", "2026-01-01T10:00:00+00:00"))
+
+    def test_results_keep_request_order(self):
+        db.upsert_user("911", state="COMPLETED")
+        db.upsert_user("922", state="ASKED_NAME")
+        db.upsert_user("933", state="REDEEMED")
+
+        results = db.redeem_users([
+            ("999", "2026-01-01T10:00:00+00:00"),
+            ("933", "2026-01-01T10:00:00+00:00"),
+            ("922", "2026-01-01T10:00:00+00:00"),
+            ("911", "2026-01-01T10:00:00+00:00"),
+        ])
+
+        self.assertEqual(
+            results, ["NOT_FOUND", "ALREADY_REDEEMED", "NOT_ELIGIBLE", "REDEEMED"]
+        )
+
+    def test_empty_batch(self):
+        self.assertEqual(db.redeem_users([]), [])
+
+    def test_stats_count_one_redemption(self):
+        db.upsert_user("911", state="COMPLETED")
+        db.redeem_users([("911", None), ("911", None)])
+
+        states = db.get_stats(hours=1)["states"]
+        self.assertEqual(states.get("REDEEMED"), 1)
+        self.assertEqual(states.get("COMPLETED"), 0)
+
+
+class CompleteSignupTest(DBTestCase):
+    def test_grant_then_already_received(self):
+        self.set_quota(5)
+
+        self.assertEqual(db.complete_signup("911", "A"), "GRANTED")
+        self.assertEqual(db.complete_signup("911", "A"), "ALREADY_RECEIVED")
+        self.assertEqual(db.get_quota(), (5, 1))
+        self.assertEqual(db.get_user("911"), ("A", "COMPLETED", None))
+
+    def test_exhausted_quota_grants_nothing(self):
+        self.set_quota(1, sent_images=1)
+
+        self.assertEqual(db.complete_signup("911", "A"), "QUOTA_EXHAUSTED")
+        self.assertIsNone(db.get_user("911"))
+        self.assertEqual(db.get_quota(), (1, 1))
+
+    def test_grant_writes_coupon_outbox(self):
+        self.set_quota(5)
+        db.complete_signup("911", "A")
+
+        rows = db.claim_coupon_outbox("9999")
+        self.assertEqual([(phone, name) for phone, name, _ in rows], [("911", "A")])
+        self.assertEqual(db.claim_coupon_outbox("9999"), [])
+
+    def test_concurrent_signups_never_oversell(self):
+        self.set_quota(5)
+        results = self.signup_concurrently(20)
+
+        self.assertEqual(results.count("GRANTED"), 5)
+        self.assertEqual(results.count("QUOTA_EXHAUSTED"), 15)
+        self.assertEqual(db.get_quota(), (5, 5))
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisQuotaSignupTest(DBTestCase):
+    def setUp(self):
+        super().setUp()
+        server = fakeredis.FakeServer()
+        patches = (
+            mock.patch.object(Config, "QUOTA_BACKEND", "redis"),
+            mock.patch.object(
+                db, "get_redis",
+                lambda: fakeredis.FakeRedis(server=server, decode_responses=True),
+            ),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_concurrent_signups_never_oversell(self):
+        self.set_quota(3)
+        results = self.signup_concurrently(12)
+
+        self.assertEqual(results.count("GRANTED"), 3)
+        self.assertEqual(db.get_quota(), (3, 3))
+
+        db.flush_quota()
+        self.assertEqual(db._db_quota(), (3, 3))
+
+    def test_repeat_signup_hands_the_slot_back(self):
+        self.set_quota(2)
+
+        self.assertEqual(db.complete_signup("911", "A"), "GRANTED")
+        self.assertEqual(db.complete_signup("911", "A"), "ALREADY_RECEIVED")
+        self.assertEqual(db.get_quota(), (2, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import time
+import unittest
+from unittest import mock
+
+from app.config import Config
+from app.qr_token import (
+    ISSUE_RESOLUTION,
+    SigningKeyMissing,
+    issue_epoch,
+    phone_from_code,
+    sign_qr,
+    verify_qr,
+)
+
+
+def _retoken(token, **parts):
+    """Replace named fields of a token without re-signing it."""
+    names = ("version", "phone", "campaign", "issued", "signature")
+    fields = dict(zip(names, token.split(".")))
+    fields.update(parts)
+    return ".".join(fields[name] for name in names)
+
+
+@mock.patch.multiple(
+    Config,
+    QR_SIGNING_KEY="test-key",
+    QR_DEV_KEY=False,
+    QR_CAMPAIGN="MELUR",
+    QR_TOKEN_MAX_AGE_DAYS=0,
+    QR_ALLOW_UNSIGNED=False,
+)
+class SignVerifyTest(unittest.TestCase):
+    def test_round_trip(self):
+        claims = verify_qr(sign_qr("919876543210"))
+
+        self.assertEqual(claims.phone, "919876543210")
+        self.assertEqual(claims.campaign, "MELUR")
+        self.assertEqual(claims.issued_at % ISSUE_RESOLUTION, 0)
+
+    def test_token_is_qr_alphanumeric(self):
+        token = sign_qr("919876543210")
+        self.assertTrue(all(c in "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ." for c in token))
+
+    def test_lowercase_input_is_accepted(self):
+        token = sign_qr("919876543210")
+        self.assertEqual(verify_qr(token.lower()).phone, "919876543210")
+        self.assertEqual(verify_qr(f"  {token}\n").phone, "919876543210")
+
+    def test_tampered_signature(self):
+        token = sign_qr("919876543210")
+        signature = token.rsplit(".", 1)[1]
+        flipped = ("A" if signature[0] != "A" else "B") + signature[1:]
+        self.assertIsNone(verify_qr(_retoken(token, signature=flipped)))
+
+    def test_tampered_phone(self):
+        token = sign_qr("919876543210")
+        self.assertIsNone(verify_qr(_retoken(token, phone="919876543211")))
+
+    def test_tampered_campaign(self):
+        token = sign_qr("919876543210")
+        self.assertIsNone(verify_qr(_retoken(token, campaign="OTHER")))
+
+    def test_other_campaign_is_rejected(self):
+        token = sign_qr("919876543210")
+        with mock.patch.object(Config, "QR_CAMPAIGN", "NEXT"):
+            self.assertIsNone(verify_qr(token))
+
+    def test_wrong_version(self):
+        token = sign_qr("919876543210")
+        self.assertIsNone(verify_qr(_retoken(token, version="C2")))
+
+    def test_other_key_is_rejected(self):
+        token = sign_qr("919876543210")
+        with mock.patch.object(Config, "QR_SIGNING_KEY", "rotated"):
+            self.assertIsNone(verify_qr(token))
+
+    def test_malformed(self):
+        for code in ("", "C1", "C1.1.2.3", "C1.a.b.c.d.e", "919876543210"):
+            self.assertIsNone(verify_qr(code), code)
+
+    def test_expiry(self):
+        issued_at = int(time.time()) - 3 * 86400
+        token = sign_qr("919876543210", issued_at=issued_at)
+
+        with mock.patch.object(Config, "QR_TOKEN_MAX_AGE_DAYS", 2):
+            self.assertIsNone(verify_qr(token))
+        with mock.patch.object(Config, "QR_TOKEN_MAX_AGE_DAYS", 4):
+            self.assertEqual(verify_qr(token).issued_at, issued_at)
+        # 0 = no expiry
+        self.assertIsNotNone(verify_qr(token))
+
+    def test_issue_epoch(self):
+        self.assertEqual(issue_epoch(), "")
+
+        with mock.patch.object(Config, "QR_TOKEN_MAX_AGE_DAYS", 2):
+            # Windows last half the lifetime: one day here
+            self.assertEqual(issue_epoch(86400 * 10), issue_epoch(86400 * 11 - 1))
+            self.assertNotEqual(issue_epoch(86400 * 10), issue_epoch(86400 * 11))
+
+    def test_unsigned_phone_needs_opt_in(self):
+        self.assertIsNone(phone_from_code("919876543210"))
+        with mock.patch.object(Config, "QR_ALLOW_UNSIGNED", True):
+            self.assertEqual(phone_from_code("919876543210"), "919876543210")
+
+
+class SigningKeyTest(unittest.TestCase):
+    @mock.patch.multiple(Config, QR_SIGNING_KEY="", QR_DEV_KEY=False)
+    def test_missing_key_refuses_to_sign_or_verify(self):
+        with self.assertRaises(SigningKeyMissing):
+            sign_qr("919876543210")
+        with self.assertRaises(SigningKeyMissing):
+            verify_qr("C1.919876543210.MELUR.T0.AAAAAAAAAAAAAAAA")
+
+    def test_dev_key_is_opt_in(self):
+        with mock.patch.multiple(Config, QR_SIGNING_KEY="", QR_DEV_KEY=True):
+            token = sign_qr("919876543210")
+            self.assertIsNotNone(verify_qr(token))
+
+        # A real key never accepts dev-key tokens
+        with mock.patch.multiple(Config, QR_SIGNING_KEY="real", QR_DEV_KEY=True):
+            self.assertIsNone(verify_qr(token))
+
+
+if __name__ == "__main__":
+    unittest.main()